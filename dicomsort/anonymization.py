@@ -0,0 +1,141 @@
+import shutil
+
+from collections import abc
+from types import MappingProxyType
+
+from dicomsort import utils
+from dicomsort.pseudonyms import Pseudonymizer
+
+# Number of bytes copied at a time from the source to the anonymized file
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Replacements whose value is derived from each file rather than used as-is
+DERIVED_FIELDS = ('PatientBirthDate',)
+
+
+class AnonymizationRules:
+    def __init__(self, lookup):
+        """
+        Anonymization replacements that are parsed once and shared by every
+        file of a sort
+
+        Replacements without format tokens are constants which are resolved
+        up front so that only the templated ones are rendered for each file.
+        Pseudonymizer replacements are computed by each file from its own
+        value of the source field. The rules are read-only because they are
+        used by many threads at once
+        """
+        if not isinstance(lookup, abc.Mapping):
+            raise Exception('Anon rules must be a dictionary')
+
+        # Copy so that later changes by the caller can't affect a running sort
+        lookup = dict(lookup)
+
+        constants = dict()
+        templates = dict()
+        pseudonyms = dict()
+        derived = list()
+
+        for key, value in lookup.items():
+            if key in DERIVED_FIELDS:
+                derived.append(key)
+            elif isinstance(value, Pseudonymizer):
+                pseudonyms[key] = value
+            elif not isinstance(value, str):
+                constants[key] = value
+            elif utils.format_fields(value):
+                templates[key] = utils.compile_format(value, lookup)
+            else:
+                # Resolves escaped percent signs just like rendering would
+                constants[key] = value % dict()
+
+        self.lookup = MappingProxyType(lookup)
+        self.constants = MappingProxyType(constants)
+        self.templates = MappingProxyType(templates)
+        self.pseudonyms = MappingProxyType(pseudonyms)
+        self.derived = tuple(derived)
+
+    def __getstate__(self):
+        # Read-only views can't be pickled to send them to worker processes
+        return {
+            key: dict(value) if isinstance(value, MappingProxyType) else value
+            for key, value in self.__dict__.items()
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update({
+            key: MappingProxyType(value) if isinstance(value, dict) else value
+            for key, value in state.items()
+        })
+
+    def __bool__(self):
+        return bool(self.lookup)
+
+    def values(self, dcm):
+        """
+        Returns the replacement values for a single file. Derived fields are
+        looked up through dcm which holds the values computed for that file
+        """
+        values = dict(self.constants)
+
+        for key, template in self.templates.items():
+            values[key] = template.render(dcm)
+
+        for key in self.derived:
+            values[key] = dcm[key] % dcm
+
+        for key in self.pseudonyms:
+            values[key] = dcm[key]
+
+        return values
+
+
+def apply_replacements(dataset, values):
+    """
+    Sets the values of the elements that exist in the dataset. Replacements
+    for elements that are not present are ignored
+    """
+    for keyword, value in values.items():
+        try:
+            element = dataset.data_element(keyword)
+        except KeyError:
+            continue
+
+        if element is not None:
+            element.value = value
+
+
+def write_anonymized(source, destination, values):
+    """
+    Writes a copy of source in which the given header elements are replaced
+
+    Only the header is parsed and re-encoded. Everything from the pixel data
+    onwards is streamed from the source file without being decoded so that
+    the memory used doesn't depend on the size of the image
+    """
+    import pydicom
+    from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+    with open(source, 'rb') as src:
+        dataset = pydicom.read_file(src, stop_before_pixels=True, force=True)
+
+        # Reading stops right before the pixel data element
+        offset = src.tell()
+
+        transfer_syntax = getattr(dataset.file_meta, 'TransferSyntaxUID', None)
+
+        # The elements of deflated files can't be separated without
+        # decompressing them so these are re-encoded entirely
+        if transfer_syntax == DeflatedExplicitVRLittleEndian:
+            dataset = pydicom.read_file(source, force=True)
+            apply_replacements(dataset, values)
+            dataset.save_as(destination)
+            return
+
+        apply_replacements(dataset, values)
+
+        with open(destination, 'wb') as dst:
+            dataset.save_as(dst, write_like_original=True)
+
+            src.seek(offset)
+            shutil.copyfileobj(src, dst, STREAM_CHUNK_SIZE)
@@ -0,0 +1,302 @@
+import argparse
+import os
+import sys
+import time
+
+import dicomsort
+
+from dicomsort import config, transfer
+from dicomsort.dicomsorter import BACKENDS, QUEUE_SIZE, DicomSorter, Sorter
+from dicomsort.headers import HeaderIndex
+from dicomsort.progress import PROGRESS_RATE
+from dicomsort.pseudonyms import STRATEGIES, PseudonymStore, Pseudonymizer
+
+# Nothing in this module may import wx so that sorting works on servers
+# without a display
+
+# Seconds between checks whether the sort has completed
+POLL_INTERVAL = 0.1
+
+# Width that progress lines are padded to
+PROGRESS_WIDTH = 79
+
+
+def parse_replacement(value):
+    """
+    Parses a FIELD=VALUE replacement given on the command line
+    """
+    field, separator, replacement = value.partition('=')
+
+    if not separator or not field:
+        msg = 'Replacements must be given as FIELD=VALUE: {}'.format(value)
+        raise argparse.ArgumentTypeError(msg)
+
+    return field, replacement
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog='dicomsort-cli',
+        description='{} without the graphical user interface'.format(
+            dicomsort.Metadata.description
+        ),
+    )
+
+    parser.add_argument(
+        '--version', action='version',
+        version='%(prog)s {}'.format(dicomsort.__version__)
+    )
+
+    parser.add_argument(
+        'paths', nargs='+', metavar='PATH',
+        help='directories that contain the DICOM files to sort'
+    )
+    parser.add_argument(
+        '-o', '--output', required=True,
+        help='directory that the sorted files are written to'
+    )
+
+    formats = parser.add_argument_group('formats')
+    formats.add_argument(
+        '-d', '--directory', action='append', dest='folders', default=[],
+        metavar='FORMAT',
+        help='format of a level of the output directories, e.g. '
+             '"%%(PatientName)s" (may be repeated)'
+    )
+    formats.add_argument(
+        '-f', '--filename', default=config.default_filename,
+        metavar='FORMAT', help='format of the output filenames'
+    )
+    formats.add_argument(
+        '--keep-filename', action='store_true',
+        help='keep the original filenames'
+    )
+    formats.add_argument(
+        '--in-place', action='store_true',
+        help='keep the original directory structure'
+    )
+    formats.add_argument(
+        '--series-first', action='store_true',
+        help='put the series number before the series description'
+    )
+
+    engine = parser.add_argument_group('engine')
+    engine.add_argument(
+        '-w', '--workers', type=int, default=None,
+        help='number of sorting threads or processes'
+    )
+    engine.add_argument(
+        '-b', '--backend', choices=BACKENDS, default='thread',
+        help='sort with threads or worker processes (default: thread)'
+    )
+    engine.add_argument(
+        '--adaptive', action='store_true',
+        help='adapt the number of threads to the observed throughput'
+    )
+    engine.add_argument(
+        '-t', '--transfer', choices=transfer.MODES, default='copy',
+        help='how unmodified files are transferred (default: copy)'
+    )
+    engine.add_argument(
+        '--move', action='store_true',
+        help='remove the original files once they are sorted'
+    )
+    engine.add_argument(
+        '--queue-size', type=int, default=QUEUE_SIZE,
+        help='number of discovered files that may wait for a worker'
+    )
+    engine.add_argument(
+        '--legacy', action='store_true',
+        help='also sort files without the DICOM preamble'
+    )
+    engine.add_argument(
+        '--index', metavar='FILE',
+        help='file that keeps the headers of sorted files so that sorting '
+             'them again is faster'
+    )
+    engine.add_argument(
+        '--dry-run', action='store_true',
+        help='print the destinations instead of sorting'
+    )
+
+    anonymization = parser.add_argument_group('anonymization')
+    anonymization.add_argument(
+        '-a', '--anonymize', action='store_true',
+        help='anonymize the fields of the configuration file'
+    )
+    anonymization.add_argument(
+        '-c', '--config', default=config.configuration_file,
+        help='configuration file with the anonymization settings '
+             '(default: %(default)s)'
+    )
+    anonymization.add_argument(
+        '-r', '--replace', action='append', type=parse_replacement,
+        default=[], metavar='FIELD=VALUE',
+        help='anonymize a field with the given value (may be repeated)'
+    )
+    anonymization.add_argument(
+        '-p', '--pseudonymize', action='append', default=[],
+        metavar='FIELD', help='replace a field with a stable pseudonym'
+    )
+    anonymization.add_argument(
+        '--pseudonym-strategy', choices=STRATEGIES, default='hash',
+        help='how pseudonyms are created (default: hash). The counter '
+             'strategy requires a store with the process backend'
+    )
+    anonymization.add_argument(
+        '--pseudonym-store', metavar='FILE',
+        help='file that keeps the pseudonyms consistent across runs'
+    )
+
+    output = parser.add_argument_group('output')
+    output.add_argument(
+        '-q', '--quiet', action='store_true',
+        help="don't report the progress"
+    )
+    output.add_argument(
+        '--progress-rate', type=float, default=PROGRESS_RATE,
+        help='maximum number of progress updates per second'
+    )
+
+    return parser
+
+
+def configured_rules(filename):
+    """
+    Returns the anonymization rules of a configuration file the same way
+    the graphical user interface applies them
+    """
+    settings = config.default_configuration['Anonymization']
+
+    if os.path.exists(filename):
+        import configobj
+
+        saved = configobj.ConfigObj(filename).get('Anonymization')
+
+        if saved is not None:
+            settings = saved
+
+    replacements = settings.get('Replacements', dict())
+
+    return {
+        field: replacements.get(field, '') for field in settings['Fields']
+    }
+
+
+def anonymization_rules(args):
+    rules = dict()
+
+    if args.anonymize:
+        rules.update(configured_rules(args.config))
+
+    rules.update(args.replace)
+
+    if args.pseudonymize:
+        store = None
+
+        if args.pseudonym_store:
+            store = PseudonymStore(args.pseudonym_store)
+
+        for field in args.pseudonymize:
+            rules[field] = Pseudonymizer(
+                field, strategy=args.pseudonym_strategy, store=store
+            )
+
+    return rules
+
+
+def create_sorter(args):
+    sorter = DicomSorter(args.paths)
+
+    sorter.folders = None if args.in_place else args.folders
+    sorter.filename = args.filename
+    sorter.keep_filename = args.keep_filename
+    sorter.series_first = args.series_first
+    sorter.keep_original = not args.move
+    sorter.read_legacy = args.legacy
+
+    sorter.workers = args.workers
+    sorter.backend = args.backend
+    sorter.adaptive = args.adaptive
+    sorter.transfer_mode = args.transfer
+    sorter.queue_size = args.queue_size
+    sorter.progress_rate = args.progress_rate
+
+    if args.index:
+        sorter.header_index = HeaderIndex(args.index)
+
+    sorter.set_anonymization_rules(anonymization_rules(args))
+
+    return sorter
+
+
+def print_progress(progress):
+    # Overwrite the previous line, including any characters it had left
+    line = str(progress).ljust(PROGRESS_WIDTH)
+    end = '\n' if progress.finished else ''
+    print('\r' + line, end=end, file=sys.stderr, flush=True)
+
+
+def summary(statistics):
+    """
+    Returns a description of the throughput of a completed sort
+    """
+    elapsed = max(statistics.elapsed(), 0.0)
+    rate = statistics.bytes / elapsed / 1e6 if elapsed else 0.0
+
+    return (
+        'Processed {} of {} files ({:.1f} MB) in {:.2f} s: {:.1f} files/s, '
+        '{:.1f} MB/s [{} backend, {} workers, queue size {}, discovery '
+        'blocked {:.2f} s]'
+    ).format(
+        statistics.processed, statistics.total, statistics.bytes / 1e6,
+        elapsed, statistics.throughput(), rate, statistics.backend,
+        statistics.workers, statistics.queue_size(), statistics.blocked
+    )
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    # Unreadable directories are skipped while walking so a mistyped path
+    # would otherwise look like an empty one
+    for path in args.paths:
+        if not os.path.isdir(path):
+            parser.error('No such directory: {}'.format(path))
+
+    try:
+        sorter = create_sorter(args)
+        listener = None if args.quiet or args.dry_run else print_progress
+        statistics = sorter.sort(
+            args.output, test=args.dry_run, listener=listener
+        )
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    try:
+        while sorter.is_sorting():
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        for worker in sorter.sorters:
+            if isinstance(worker, Sorter):
+                worker.stop()
+
+        print('\nInterrupted', file=sys.stderr)
+        return 130
+
+    for filename, error in statistics.failures:
+        print('Failed to sort {}: {}'.format(filename, error), file=sys.stderr)
+
+    if not args.quiet:
+        print(summary(statistics), file=sys.stderr)
+
+    # Batch jobs need to notice runs that didn't sort every file
+    if statistics.failures or statistics.processed != statistics.total:
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
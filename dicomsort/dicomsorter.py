@@ -1,31 +1,142 @@
-import itertools
+import multiprocessing
 import os
-import pydicom
 import shutil
+import time
+import traceback
 
-from collections import abc
-from queue import Empty, Queue
+from collections import ChainMap, abc
+from queue import Empty, Full, Queue
 from threading import Thread
 
-from dicomsort import errors, utils
-from dicomsort.gui import events
+from dicomsort import errors, utils, walker
+from dicomsort.anonymization import (
+    AnonymizationRules,
+    apply_replacements,
+    write_anonymized,
+)
+from dicomsort.progress import (
+    PROGRESS_RATE,
+    ProgressCounter,
+    ProgressReporter,
+)
+from dicomsort.pseudonyms import Pseudonymizer
+from dicomsort.transfer import Transfer, temporary_name
 
 
 THREAD_COUNT = 2
 
+# Number of files that are sent to a worker process at a time
+CHUNK_SIZE = 16
+
+# Worker processes are started from scratch rather than forked from a
+# process that is running other threads (discovery, the GUI) and this is the
+# only start method available on Windows
+START_METHOD = 'spawn'
+
+# Maximum number of output directories that are remembered during a sort
+DESTINATION_CACHE_SIZE = 10000
+
+# Default number of discovered files that may wait for a worker. Discovery
+# blocks once the queue is full so memory use doesn't grow with the input
+QUEUE_SIZE = 10000
+
+# Seconds that a worker waits for the next file (and discovery for room in
+# the queue) before checking whether the other side is done
+QUEUE_TIMEOUT = 0.1
+
+BACKENDS = ('thread', 'process')
+
+# Bounds and sampling period used when adapting the number of threads
+MAX_THREADS = 64
+TUNE_INTERVAL = 1.0
+
+# Fraction of time without any thread on the CPU above which the sort is
+# considered to be I/O bound and more threads are added
+IO_WAIT_THRESHOLD = 0.5
+
+# Relative drop in throughput that causes the last adjustment to be reverted
+THROUGHPUT_TOLERANCE = 0.1
+
+# Fields that the built-in overrides read in order to compute their values
+OVERRIDE_FIELDS = {
+    'FileExtension': [],
+    'ImageType': ['ImageType', 'InstanceNumber', 'SeriesNumber'],
+    'SeriesDescription': ['SeriesDescription', 'SeriesNumber'],
+}
+
+# Fields used to anonymize the birth date while retaining the patient age
+BIRTH_DATE_FIELDS = ['PatientAge', 'PatientBirthDate', 'StudyDate']
+
+
+def required_fields(format_strings, anonymization_lookup=None):
+    """
+    Determines all fields that are needed to render the format strings and
+    the anonymization replacements, including any nested references
+    """
+    lookup = anonymization_lookup or dict()
+
+    pending = set()
+    for format_string in format_strings:
+        pending.update(utils.format_fields(format_string))
+
+    # All replacements are rendered when an anonymous file is written
+    for value in lookup.values():
+        if isinstance(value, str):
+            pending.update(utils.format_fields(value))
+        elif isinstance(value, Pseudonymizer):
+            pending.add(value.field)
+
+    if 'PatientBirthDate' in lookup:
+        pending.update(BIRTH_DATE_FIELDS)
+
+    return referenced_fields(pending, lookup, OVERRIDE_FIELDS)
+
+
+def referenced_fields(fields, lookup, overrides=None):
+    """
+    Returns the fields together with all fields that they refer to through
+    the templated replacements of the lookup and, if provided, the fields
+    that the overrides read
+    """
+    overrides = overrides or dict()
+    pending = set(fields)
+    fields = set()
+
+    while pending:
+        field = pending.pop()
+
+        if field in fields:
+            continue
+
+        fields.add(field)
+
+        if isinstance(lookup.get(field), str):
+            pending.update(utils.format_fields(lookup[field]))
+        elif field in overrides:
+            pending.update(overrides[field])
+
+    return fields
+
 
 class Dicom:
-    def __init__(self, filename, dcm=None):
+    def __init__(self, filename, dcm=None, header_only=False):
         """
         Takes a dicom filename in and returns instance that can be used to sort
+
+        If header_only is True, the dataset is expected to stop before the
+        pixel data and the full file is only read when it has to be re-written
         """
         # Be sure to do encoding because Windows sucks
         self.filename = filename
+        self.header_only = header_only
 
         # Load the DICOM object
         if dcm:
             self.dicom = dcm
+        elif header_only:
+            self.dicom = utils.read_header(self.filename)
         else:
+            import pydicom
             self.dicom = pydicom.read_file(self.filename)
 
         self.series_first = False
@@ -37,6 +148,9 @@ class Dicom:
         }
 
         self.overrides = dict(self.default_overrides)
+        self.anonymization_lookup = dict()
+        self.derived_values = dict()
+        self.rules = None
 
     def __getitem__(self, attr):
         """
@@ -111,7 +225,7 @@ class Dicom:
 
         return 'Image'
 
-    def get_destination(self, root, directory_format, filename_format):
+    def get_directory(self, root, directory_format):
 
         # First we need to clean up the elements of directory_format to make
         # sure that we don't have any bad characters (including /) in the
@@ -119,17 +233,27 @@ class Dicom:
         directory = root
         for item in directory_format:
             try:
-                subdir = utils.recursive_replace_tokens(item, self)
+                subdir = utils.compile_format(item).render(self)
                 subdir = utils.clean_directory_name(subdir)
             except AttributeError:
                 subdir = 'UNKNOWN'
 
             directory = os.path.join(directory, subdir)
 
+        return directory
+
+    def get_destination(self, root, directory_format, filename_format,
+                        cache=None):
+
+        if cache is None:
+            directory = self.get_directory(root, directory_format)
+        else:
+            directory = cache.get(self, root, directory_format)
+
         # Maximum recursion is 5 so we don't end up with any infinite loop
         # situations
         try:
-            filename = utils.recursive_replace_tokens(filename_format, self)
+            filename = utils.compile_format(filename_format).render(self)
             filename = utils.clean_path(filename)
             out = os.path.join(directory, filename)
         except AttributeError:
@@ -140,50 +264,64 @@ class Dicom:
         return out
 
     def set_anonymization_rules(self, anonymization_lookup):
-        # Appends the rules to the overrides so that we can alter them
-        if isinstance(anonymization_lookup, dict):
-            self.anonymization_lookup = anonymization_lookup
+        """
+        Applies either a dictionary of replacements or AnonymizationRules
+        that were compiled once for the entire sort
+        """
+        if isinstance(anonymization_lookup, AnonymizationRules):
+            self.rules = anonymization_lookup
         else:
-            raise Exception('Anon rules must be a dictionary')
+            self.rules = AnonymizationRules(anonymization_lookup)
 
-        if 'PatientBirthDate' in self.anonymization_lookup:
-            if self.anonymization_lookup['PatientBirthDate'] != '' or \
-                    self.dicom.PatientBirthDate == '':
+        self.anonymization_lookup = self.rules.lookup
 
-                self.overrides = dict(
-                    self.default_overrides,
-                    **anonymization_lookup
-                )
+        # Values derived from this file are kept separate from the rules,
+        # which are shared with every other file of the sort
+        self.derived_values = dict()
 
-                return
+        # Derived values take precedence over the replacements which take
+        # precedence over the default overrides, without copying any of them
+        self.overrides = ChainMap(
+            self.derived_values, self.anonymization_lookup,
+            self.default_overrides
+        )
 
-            # First we need to figure out how old they are
-            if 'PatientAge' in self.dicom and 'StudyDate' in self.dicom:
-                self.dicom.PatientAge = self._patient_age()
+        for key, pseudonymizer in self.rules.pseudonyms.items():
+            source = getattr(self.dicom, pseudonymizer.field, '')
+            self.derived_values[key] = pseudonymizer(source)
 
-            if 'StudyDate' in self.dicom:
-                # Now set it so it is just the birth year but make it so that
-                # the proper age is returned when doing year math
-                birth_date = int(self.dicom.PatientBirthDate[4:])
-                study_date = int(self.dicom.StudyDate[4:])
+        if 'PatientBirthDate' not in self.anonymization_lookup:
+            return
 
-                # If the study was performed after their birthday this year
-                if study_date >= birth_date:
-                    new_birth_date = '%s0101' % self.dicom.PatientBirthDate[:4]
-                else:
-                    birth_year = self.dicom.PatientBirthDate[:4]
-                    new_birth_date = '%d0101' % (int(birth_year) + 1)
+        if self.anonymization_lookup['PatientBirthDate'] != '' or \
+                self.dicom.get('PatientBirthDate', '') == '':
+            return
+
+        # First we need to figure out how old they are
+        if 'PatientAge' in self.dicom and 'StudyDate' in self.dicom:
+            self.dicom.PatientAge = self._patient_age()
+
+        if 'StudyDate' in self.dicom:
+            # Now set it so it is just the birth year but make it so that
+            # the proper age is returned when doing year math
+            birth_date = int(self.dicom.PatientBirthDate[4:])
+            study_date = int(self.dicom.StudyDate[4:])
 
-                self.anonymization_lookup['PatientBirthDate'] = new_birth_date
+            # If the study was performed after their birthday this year
+            if study_date >= birth_date:
+                new_birth_date = '%s0101' % self.dicom.PatientBirthDate[:4]
+            else:
+                birth_year = self.dicom.PatientBirthDate[:4]
+                new_birth_date = '%d0101' % (int(birth_year) + 1)
 
-        # Update the override dictionary
-        self.overrides = dict(self.default_overrides, **anonymization_lookup)
+            self.derived_values['PatientBirthDate'] = new_birth_date
 
     def is_anonymous(self):
-        return self.default_overrides != self.overrides
+        return bool(self.rules)
 
     def sort(self, root, directory_fields, filename_string, test=False,
-             rootdir=None, keep_original=True):
+             rootdir=None, keep_original=True, cache=None, directories=None,
+             registry=None, transfer=None):
 
         # If we want to sort in place
         if directory_fields is None:
@@ -191,78 +329,199 @@ class Dicom:
             destination = os.path.join(root, destination)
         else:
             destination = self.get_destination(
-                root, directory_fields, filename_string
+                root, directory_fields, filename_string, cache=cache
             )
 
         if test:
             print(destination)
             return
 
-        utils.mkdir(os.path.dirname(destination))
+        if directories is None:
+            utils.mkdir(os.path.dirname(destination))
+        else:
+            directories.mkdir(os.path.dirname(destination))
 
         # Check if destination exists
-        while os.path.exists(destination):
-            destination = destination + '.copy'
+        if registry is None:
+            while os.path.exists(destination):
+                destination = destination + '.copy'
+        else:
+            destination = registry.reserve(destination)
 
         if self.is_anonymous():
-            # Actually write the anonymous data
-            # write everything in anonymization_lookup -> Parse it so we can
-            # have dynamic fields
-            for key in self.anonymization_lookup.keys():
-                replacement_value = self.anonymization_lookup[key] % self
-                try:
-                    self.dicom.data_element(key).value = replacement_value
-                except KeyError:
-                    continue
+            # Constant replacements were resolved when the rules were
+            # compiled so only the templated ones are rendered here
+            values = self.rules.values(self)
 
-            self.dicom.save_as(destination)
+            # Write to a temporary file first so that the destination never
+            # contains a partially written file
+            temporary = temporary_name(destination)
+
+            try:
+                if self.header_only:
+                    # Only the header is re-written and the pixel data is
+                    # streamed from the original file
+                    write_anonymized(self.filename, temporary, values)
+                else:
+                    apply_replacements(self.dicom, values)
+                    self.dicom.save_as(temporary)
+
+                os.replace(temporary, destination)
+            except Exception:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+
+                if registry is not None:
+                    registry.release(destination)
+
+                raise
 
             if keep_original is False:
                 os.remove(self.filename)
 
         else:
-            if keep_original:
-                shutil.copy(self.filename, destination)
-            else:
-                shutil.move(self.filename, destination)
+            try:
+                if keep_original:
+                    if transfer is None:
+                        shutil.copy(self.filename, destination)
+                    else:
+                        transfer(self.filename, destination)
+                elif transfer is None:
+                    shutil.move(self.filename, destination)
+                else:
+                    transfer.move(self.filename, destination)
+            except Exception:
+                if registry is not None:
+                    registry.release(destination)
 
+                raise
 
-class Sorter(Thread):
-    def __init__(self, queue, output_directory, directory_format,
-                 filename_format, lookup=None, keep_filename=False,
-                 iterator=None, test=False, listener=None, total=None,
-                 root=None, series_first=False, keep_original=True):
 
+class DestinationCache:
+    def __init__(self, directory_format, lookup=None,
+                 maxsize=DESTINATION_CACHE_SIZE):
+        """
+        Remembers the output directory of files that have the same values
+        for every field used by the directory format (e.g. all files of a
+        series) so it is only rendered and cleaned once
+
+        Replacements of the anonymization lookup that are templates render
+        other fields, so those are part of the key as well
+        """
+        fields = set()
+        for item in directory_format:
+            fields.update(utils.compile_format(item).fields)
+
+        fields = referenced_fields(fields, lookup or dict())
+
+        self.fields = sorted(fields)
+        self.maxsize = maxsize
+        self.directories = dict()
+
+    def key(self, dcm):
+        try:
+            return tuple(str(dcm[field]) for field in self.fields)
+        except AttributeError:
+            # Missing fields are rendered as UNKNOWN by get_directory
+            return None
+
+    def get(self, dcm, root, directory_format):
+        key = self.key(dcm)
+
+        if key is None:
+            return dcm.get_directory(root, directory_format)
+
+        key = (root,) + key
+
+        try:
+            return self.directories[key]
+        except KeyError:
+            pass
+
+        directory = dcm.get_directory(root, directory_format)
+
+        # Dictionary operations are atomic so this is safe to share between
+        # threads. At worst a directory is computed more than once
+        if len(self.directories) >= self.maxsize:
+            self.directories.clear()
+
+        self.directories[key] = directory
+
+        return directory
+
+
+class SortJob:
+    def __init__(self, output_directory, directory_format, filename_format,
+                 lookup=None, keep_filename=False, test=False, root=None,
+                 series_first=False, keep_original=True, tags=None,
+                 legacy=False, transfer_mode='copy', index=None):
+        """
+        Settings that are shared by all workers of a single sort
+
+        Instances are pickled when they are sent to worker processes so they
+        must not reference any GUI objects
+        """
         self.directory_format = directory_format
         self.filename_format = filename_format
-        self.queue = queue
         self.anonymization_lookup = lookup or dict()
         self.keep_filename = keep_filename
         self.series_first = series_first
         self.keep_original = keep_original
         self.output_directory = output_directory
         self.test = test
-        self.iter = iterator
         self.root = root
-        self.total = total or self.queue.qsize()
+        self.tags = tags
+        self.legacy = legacy
 
-        self.is_gui = False
+        # Optional HeaderIndex that unchanged files are read from
+        self.index = index
 
-        if listener:
-            self.listener = listener
-            self.is_gui = True
+        # Parse the formats once rather than for every file
+        if directory_format is not None:
+            self.directory_format = [
+                utils.compile_format(item, self.anonymization_lookup)
+                for item in directory_format
+            ]
 
-        Thread.__init__(self)
-        self.start()
+        self.filename_format = utils.compile_format(
+            filename_format, self.anonymization_lookup
+        )
+
+        if directory_format is None:
+            self.destinations = None
+        else:
+            self.destinations = DestinationCache(
+                self.directory_format, self.anonymization_lookup
+            )
+
+        # Shared by every file rather than being rebuilt for each of them
+        self.rules = AnonymizationRules(self.anonymization_lookup)
+
+        self.directories = utils.DirectoryCache(output_directory)
+        self.registry = utils.DestinationRegistry()
+        self.transfer = Transfer(transfer_mode)
 
     def sort_image(self, filename):
-        dcm = utils.isdicom(filename)
+        """
+        Sorts a single file and returns its size in bytes (zero if it isn't
+        a DICOM file)
+        """
+        if self.index is None:
+            dcm = utils.isdicom(
+                filename, header_only=True, specific_tags=self.tags,
+                legacy=self.legacy
+            )
+        else:
+            dcm = self.index.read(filename, self.tags, self.legacy)
 
         if not dcm:
-            return
+            return 0
+
+        # The source may no longer exist once it was sorted
+        size = os.path.getsize(filename)
 
-        dcm = Dicom(filename, dcm)
-        dcm.set_anonymization_rules(self.anonymization_lookup)
+        dcm = Dicom(filename, dcm, header_only=True)
+        dcm.set_anonymization_rules(self.rules)
         dcm.series_first = self.series_first
 
         # Use the original filename for 3d recons
@@ -277,31 +536,447 @@ class Sorter(Thread):
             output_filename,
             test=self.test,
             rootdir=self.root,
-            keep_original=self.keep_original
+            keep_original=self.keep_original,
+            cache=self.destinations,
+            directories=self.directories,
+            registry=self.registry,
+            transfer=self.transfer
         )
 
-    def increment_counter(self):
-        if self.iter is None:
-            return
+        return size
 
-        count = next(self.iter)
 
-        if self.is_gui is False:
-            return
+# The job of the current worker process
+_process_job = None
+
+
+def _initialize_process(job):
+    global _process_job
+    _process_job = job
+
+
+def describe_error(exc):
+    """
+    Returns a one line description of an exception, e.g. "OSError: ..."
+    """
+    return traceback.format_exception_only(type(exc), exc)[-1].strip()
+
+
+def _sort_chunk(filenames):
+    """
+    Sorts the files in a worker process and returns the size of each sorted
+    file and the (filename, error) of each file that couldn't be sorted
+    """
+    sizes = list()
+    failures = list()
+
+    for filename in filenames:
+        try:
+            sizes.append(_process_job.sort_image(filename))
+        except Exception as exc:
+            failures.append((filename, describe_error(exc)))
+
+    return sizes, failures
+
+
+class SortStatistics(utils.Locked):
+    def __init__(self, backend, workers, total=0, queue=None):
+        """
+        Summary of a sort that is updated by the workers as files complete
+        """
+        super(SortStatistics, self).__init__()
+
+        self.backend = backend
+        self.workers = workers
+        self.total = total
+        self.processed = 0
+
+        # Number of bytes of the sorted files
+        self.bytes = 0
+
+        self.queue = queue
+
+        # Seconds that discovery waited for room in the queue
+        self.blocked = 0.0
+
+        # (filename, error) of the files that couldn't be sorted
+        self.failures = list()
 
-        event = events.CounterEvent(Count=count, total=self.total)
-        events.post_event(self.listener, event)
+        self.started = time.time()
+        self.updated = self.started
+
+    def add(self, count, size=0):
+        """
+        Merges the number of files (and their bytes) that a worker sorted
+        """
+        with self.lock:
+            self.processed += count
+            self.bytes += size
+            self.updated = time.time()
+
+    def fail(self, filename, error):
+        with self.lock:
+            self.failures.append((filename, error))
+            self.updated = time.time()
+
+    def completed(self):
+        """
+        Returns the number of files that were either sorted or failed
+        """
+        return self.processed + len(self.failures)
+
+    def elapsed(self):
+        return self.updated - self.started
+
+    def queue_depth(self):
+        """
+        Returns the number of discovered files that are waiting for a worker
+        """
+        if self.queue is None:
+            return 0
+
+        return self.queue.qsize()
+
+    def queue_size(self):
+        return 0 if self.queue is None else self.queue.maxsize
+
+    def throughput(self):
+        """
+        Returns the number of files that were sorted per second
+        """
+        elapsed = self.elapsed()
+
+        if elapsed <= 0:
+            return 0.0
+
+        return self.processed / elapsed
+
+
+class Discovery(Thread):
+    def __init__(self, queue, paths, statistics, spawn=None, workers=0,
+                 sorters=None):
+        """
+        Walks the input paths and feeds the files to the queue while the
+        workers are already sorting them
+
+        spawn is called to start a worker for each of the first files until
+        the requested number of workers is running. The thread is not started
+        automatically so that spawn can refer to it. If sorters (the list
+        that the spawned workers are added to) is provided, discovery stops
+        once none of them is left to empty the queue
+        """
+        self.queue = queue
+        self.paths = paths
+        self.statistics = statistics
+        self.spawn = spawn
+        self.workers = workers
+        self.spawned = 0
+        self.sorters = sorters
+
+        # Set once every file has been put on the queue
+        self.finished = False
+
+        Thread.__init__(self)
+        self.daemon = True
+
+    def workers_alive(self):
+        if self.sorters is None or not self.spawned:
+            return True
+
+        return any(
+            isinstance(sorter, Sorter) and sorter.is_alive()
+            for sorter in self.sorters
+        )
+
+    def put(self, filename):
+        """
+        Queues a file, waiting for the workers to catch up if the queue is
+        full. Returns False if no worker is left to sort it
+        """
+        try:
+            self.queue.put_nowait(filename)
+            return True
+        except Full:
+            pass
+
+        started = time.time()
+
+        try:
+            while True:
+                try:
+                    self.queue.put(filename, timeout=QUEUE_TIMEOUT)
+                    return True
+                except Full:
+                    if not self.workers_alive():
+                        return False
+        finally:
+            self.statistics.blocked += time.time() - started
 
     def run(self):
+        try:
+            for filename in walker.walk_files(self.paths):
+                if not self.put(filename):
+                    break
+
+                self.statistics.total += 1
+
+                if self.spawned < self.workers:
+                    self.spawn()
+                    self.spawned += 1
+
+                    # A single sorter may already account for several
+                    # workers (e.g. the processes of its pool)
+                    self.statistics.workers = max(
+                        self.statistics.workers, self.spawned
+                    )
+        finally:
+            self.finished = True
+
+
+class Sorter(Thread):
+    def __init__(self, queue, job, reporter=None, total=None,
+                 statistics=None, discovery=None):
+        self.queue = queue
+        self.job = job
+        self.total = total or self.queue.qsize()
+        self.statistics = statistics
+        self.discovery = discovery
+
+        # Rate-limited progress reports for the listener of the sort
+        self.reporter = reporter
+
+        # Files are counted locally and merged into the statistics
+        if statistics is None:
+            self.counter = None
+        else:
+            self.counter = ProgressCounter(statistics, reporter)
+
+        # Set by stop() to finish after the current file
+        self.stopped = False
+
+        # (filename, error) of the files this worker couldn't sort
+        self.failures = list()
+
+        Thread.__init__(self)
+        self.start()
+
+    def sort_image(self, filename):
+        return self.job.sort_image(filename)
+
+    def increment_counter(self, count=1, size=0):
+        if self.counter is not None:
+            self.counter.add(count, size)
+
+    def finish_counter(self):
+        """
+        Merges the remaining counts once the worker is done
+        """
+        if self.counter is not None:
+            self.counter.merge()
+        elif self.reporter is not None:
+            self.reporter.update()
+
+    def fail(self, filename, error):
+        """
+        Records a file that couldn't be sorted so the others still are
+        """
+        self.failures.append((filename, error))
+
+        if self.statistics is not None:
+            self.statistics.fail(filename, error)
+
+    def stop(self):
+        self.stopped = True
+
+    def next_file(self):
+        """
+        Returns the next queued file or None once the queue is drained and
+        no more files will be discovered
+        """
         while True:
             try:
-                filename = self.queue.get_nowait()
-                self.sort_image(filename)
-                self.increment_counter()
-            # TODO: Rescue any other errors and quarantine the files
+                if self.discovery is None:
+                    return self.queue.get_nowait()
+
+                return self.queue.get(timeout=QUEUE_TIMEOUT)
             except Empty:
+                if self.discovery is None:
+                    return None
+
+                if self.discovery.finished and self.queue.empty():
+                    return None
+
+    def run(self):
+        try:
+            while not self.stopped:
+                filename = self.next_file()
+
+                if filename is None:
+                    break
+
+                try:
+                    size = self.sort_image(filename)
+                except Exception as exc:
+                    self.fail(filename, describe_error(exc))
+                    continue
+
+                self.increment_counter(1, size)
+        finally:
+            # This also reports the final progress if this was the last
+            # worker
+            self.finish_counter()
+
+
+class ProcessSorter(Sorter):
+    def __init__(self, queue, job, processes=None, chunk_size=CHUNK_SIZE,
+                 **kwargs):
+        """
+        Dispatches the queued files in chunks to a pool of worker processes
+        and reports their progress from within the parent process
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+        super(ProcessSorter, self).__init__(queue, job, **kwargs)
+
+    def chunks(self):
+        chunk = list()
+
+        # Chunks that were already dispatched are still completed
+        while not self.stopped:
+            filename = self.next_file()
+
+            if filename is None:
+                break
+
+            chunk.append(filename)
+
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = list()
+
+        if chunk:
+            yield chunk
+
+    def run(self):
+        # Look for existing output directories once rather than in every
+        # worker process
+        self.job.directories.seed()
+
+        context = multiprocessing.get_context(START_METHOD)
+
+        pool = context.Pool(
+            self.processes,
+            initializer=_initialize_process,
+            initargs=(self.job,)
+        )
+
+        try:
+            # Each chunk is counted at once rather than file by file
+            chunks = pool.imap_unordered(_sort_chunk, self.chunks())
+
+            for sizes, failures in chunks:
+                for filename, error in failures:
+                    self.fail(filename, error)
+
+                self.increment_counter(len(sizes), sum(sizes))
+        finally:
+            pool.terminate()
+            pool.join()
+            self.finish_counter()
+
+
+class Tuner(Thread):
+    def __init__(self, spawn, sorters, statistics, maximum=MAX_THREADS,
+                 interval=TUNE_INTERVAL, discovery=None):
+        """
+        Periodically measures the throughput and the time that no thread
+        spends on the CPU and adds or stops sorter threads accordingly
+
+        spawn is called without arguments to start a new sorter thread
+        """
+        self.spawn = spawn
+        self.sorters = sorters
+        self.statistics = statistics
+        self.maximum = maximum
+        self.interval = interval
+        self.discovery = discovery
+
+        Thread.__init__(self)
+        self.daemon = True
+        self.start()
+
+    def active(self):
+        return [
+            s for s in self.sorters
+            if isinstance(s, Sorter) and s.is_alive() and not s.stopped
+        ]
+
+    def adjust(self, direction):
+        active = self.active()
+        count = len(active) + direction
+
+        if direction > 0 and count <= self.maximum:
+            self.spawn()
+        elif direction < 0 and count >= 1:
+            active[-1].stop()
+        else:
+            return
+
+        self.statistics.workers = count
+
+    def is_finished(self):
+        if self.discovery is not None and not self.discovery.finished:
+            return False
+
+        return not self.active()
+
+    def backlog(self):
+        """
+        Returns the number of discovered files that are not yet sorted
+        """
+        return self.statistics.total - self.statistics.processed
+
+    def run(self):
+        previous_rate = None
+        direction = 0
+
+        processed = self.statistics.processed
+        wall = time.time()
+        cpu = time.process_time()
+
+        while True:
+            time.sleep(self.interval)
+
+            if self.is_finished():
                 return
 
+            now = time.time()
+            elapsed = now - wall
+
+            rate = (self.statistics.processed - processed) / elapsed
+            io_wait = 1.0 - (time.process_time() - cpu) / elapsed
+
+            processed = self.statistics.processed
+            wall = now
+            cpu = time.process_time()
+
+            if previous_rate is not None and direction != 0 and \
+                    rate < previous_rate * (1 - THROUGHPUT_TOLERANCE):
+                # The last change made things worse so revert it
+                direction = -direction
+            elif io_wait >= IO_WAIT_THRESHOLD and \
+                    self.backlog() > len(self.active()):
+                direction = 1
+            else:
+                # The threads already keep the CPU busy
+                direction = 0
+
+            previous_rate = rate
+
+            if direction != 0:
+                self.adjust(direction)
+
 
 class DicomSorter():
     def __init__(self, pathname=None):
@@ -317,9 +992,12 @@ class DicomSorter():
         self.folders = []
         self.filename = '%(ImageType)s (%(InstanceNumber)04d)%(FileExtension)s'
 
-        self.queue = Queue()
+        # Maximum number of discovered files waiting for a worker
+        self.queue_size = QUEUE_SIZE
+        self.queue = Queue(self.queue_size)
 
         self.sorters = list()
+        self.discovery = None
 
         # Don't anonymize by default
         self.anonymization_lookup = dict()
@@ -328,7 +1006,33 @@ class DicomSorter():
         self.series_first = False
         self.keep_original = True
 
+        # Also sort files that lack the DICOM preamble and prefix
+        self.read_legacy = False
+
+        # How files are copied when they aren't modified (see transfer.MODES)
+        self.transfer_mode = 'copy'
+
+        # HeaderIndex that keeps the headers of sorted files so that sorting
+        # them again doesn't parse them (None disables the index)
+        self.header_index = None
+
+        # Sort with threads unless worker processes are requested
+        self.backend = 'thread'
+
+        # Number of workers (None picks a default for the backend) and
+        # whether the number of threads adapts to the observed throughput
+        self.workers = None
+        self.adaptive = False
+
+        # Maximum number of progress reports per second sent to a listener
+        self.progress_rate = PROGRESS_RATE
+
+        self.statistics = None
+
     def is_sorting(self):
+        if self.discovery is not None and self.discovery.is_alive():
+            return True
+
         for sorter in self.sorters:
             if sorter.is_alive():
                 return True
@@ -352,39 +1056,145 @@ class DicomSorter():
 
         return folder_list
 
+    def required_tags(self):
+        """
+        Returns the keywords of all DICOM elements that sorting relies on
+        """
+        formats = list(self.folder_format() or [])
+
+        # Sorting in place or keeping the filename ignores the filename format
+        if self.folders is not None and not self.keep_filename:
+            formats.append(self.filename)
+
+        fields = required_fields(formats, self.anonymization_lookup)
+
+        # Always decode the character set (this also prevents an empty list
+        # which would cause every element to be read)
+        fields.add('SpecificCharacterSet')
+
+        from pydicom.datadict import keyword_dict
+
+        return sorted(field for field in fields if field in keyword_dict)
+
+    def worker_count(self):
+        if self.workers is not None:
+            return self.workers
+
+        if self.backend == 'process':
+            return os.cpu_count() or 1
+
+        return THREAD_COUNT
+
     def sort(self, output_directory, test=False, listener=None):
-        # This should be moved to a worker thread
-        for path in self.pathname:
-            for root, _, files in os.walk(path):
-                for filename in files:
-                    self.queue.put(os.path.join(root, filename))
+        """
+        Starts sorting in the background and returns the SortStatistics that
+        the workers update as they progress
+
+        listener is called with the Progress of the sort (see
+        dicomsort.progress). GUI toolkits provide adapters that forward it
+        to their windows
+        """
+        if self.backend not in BACKENDS:
+            raise ValueError('Unknown backend: {}'.format(self.backend))
 
-        number_of_files = self.queue.qsize()
-        dir_format = self.folder_format()
+        # A size of zero would make the queue unbounded
+        if self.queue_size < 1:
+            raise ValueError('Invalid queue size: {}'.format(self.queue_size))
+
+        if self.workers is not None and self.workers < 1:
+            raise ValueError(
+                'Invalid number of workers: {}'.format(self.workers)
+            )
+
+        if self.backend == 'process':
+            for value in self.anonymization_lookup.values():
+                if isinstance(value, Pseudonymizer) and \
+                        not value.is_consistent():
+                    raise ValueError(
+                        'Counter pseudonyms require a pseudonym store when '
+                        'sorting with worker processes'
+                    )
+
+        if listener is not None and not callable(listener):
+            raise TypeError('The listener must be callable')
+
+        job = SortJob(
+            output_directory, self.folder_format(), self.filename,
+            self.anonymization_lookup, self.keep_filename, test=test,
+            root=self.pathname, series_first=self.series_first,
+            keep_original=self.keep_original, tags=self.required_tags(),
+            legacy=self.read_legacy, transfer_mode=self.transfer_mode,
+            index=self.header_index
+        )
 
         self.sorters = list()
 
-        iterator = itertools.count(1)
+        self.queue = Queue(self.queue_size)
+        self.statistics = SortStatistics(self.backend, 0, queue=self.queue)
 
-        for _ in range(min(THREAD_COUNT, number_of_files)):
-            sorter = Sorter(
-                self.queue, output_directory, dir_format, self.filename,
-                self.anonymization_lookup, self.keep_filename,
-                iterator=iterator, test=test, listener=listener,
-                total=number_of_files, root=self.pathname,
-                series_first=self.series_first,
-                keep_original=self.keep_original
-            )
+        if self.backend == 'process':
+            # A single thread dispatches the files to all processes
+            processes = self.worker_count()
+            workers = 1
+
+            self.statistics.workers = processes
+        else:
+            workers = self.worker_count()
+
+        reporter = None
+
+        def spawn():
+            if self.backend == 'process':
+                sorter = ProcessSorter(
+                    self.queue, job, processes=processes, reporter=reporter,
+                    statistics=self.statistics, discovery=self.discovery
+                )
+            else:
+                sorter = Sorter(
+                    self.queue, job, reporter=reporter,
+                    statistics=self.statistics, discovery=self.discovery
+                )
 
             self.sorters.append(sorter)
 
+            return sorter
+
+        # Workers are started as files are found so that sorting overlaps
+        # with walking the directory tree
+        self.discovery = Discovery(
+            self.queue, self.pathname, self.statistics, spawn=spawn,
+            workers=workers, sorters=self.sorters
+        )
+
+        if listener is not None:
+            reporter = ProgressReporter(
+                listener, self.statistics,
+                discovery=self.discovery, rate=self.progress_rate
+            )
+
+        self.discovery.start()
+
+        if self.adaptive and self.backend == 'thread':
+            self.sorters.append(Tuner(
+                spawn, self.sorters, self.statistics,
+                maximum=max(MAX_THREADS, workers), discovery=self.discovery
+            ))
+
+        return self.statistics
+
     def available_fields(self):
-        for path in self.pathname:
-            for root, dirs, files in os.walk(path):
-                for filename in files:
-                    dcm = utils.isdicom(os.path.join(root, filename))
-                    if dcm:
-                        return dcm.dir('')
+        for filename in walker.walk_files(self.pathname):
+            if self.header_index is None:
+                dcm = utils.isdicom(
+                    filename, header_only=True, legacy=self.read_legacy
+                )
+            else:
+                dcm = self.header_index.read(
+                    filename, legacy=self.read_legacy
+                )
+
+            if dcm:
+                return dcm.dir('')
 
         msg = ''.join([';'.join(self.pathname), ' contains no DICOMs'])
         raise errors.DicomFolderError(msg)
@@ -8,15 +8,15 @@ from dicomsort import Metadata as meta
 from dicomsort.dicomsorter import DicomSorter
 from dicomsort.errors import DicomFolderError
 from dicomsort.gui import errors, events, icons, preferences, widgets
-from dicomsort.gui.dialogs import (
-    AboutDlg, CrashReporter, HelpDlg, QuickRenameDlg, UpdateDlg
-)
 from dicomsort.gui.update import UpdateChecker
 
 DEFAULT_FILENAME = '%(ImageType)s (%(InstanceNumber)04d)%(FileExtension)s'
 
 
 def except_hook(exc_type, value, tb):
+    # Dialogs are only imported once they are shown to speed up the startup
+    from dicomsort.gui.dialogs import CrashReporter
+
     dlg = CrashReporter(None, type=exc_type, value=value, traceback=tb)
     dlg.ShowModal()
     dlg.Destroy()
@@ -78,6 +78,8 @@ class MainFrame(wx.Frame):
         self.SetStatusText("Ready...")
 
     def OnNewVersion(self, evnt):
+        from dicomsort.gui.dialogs import UpdateDlg
+
         dlg = UpdateDlg(self, evnt.version)
         dlg.Show()
 
@@ -150,12 +152,20 @@ class MainFrame(wx.Frame):
             return
 
         # Use for the real deal
-        self.dicom_sorter.sort(self.outputDirectory, listener=self)
+        self.dicom_sorter.sort(
+            self.outputDirectory, listener=events.ProgressListener(self)
+        )
 
         self.Bind(events.EVT_COUNTER, self.OnCount)
 
     def OnCount(self, event):
-        status = '%s / %s' % (event.Count, event.total)
+        progress = getattr(event, 'progress', None)
+
+        if progress is None:
+            status = '%s / %s' % (event.Count, event.total)
+        else:
+            status = str(progress)
+
         self.SetStatusText(status)
 
     def SelectOutputDir(self):
@@ -184,9 +194,13 @@ class MainFrame(wx.Frame):
         sys.exit(0)
 
     def OnAbout(self, *_event):
+        from dicomsort.gui.dialogs import AboutDlg
+
         AboutDlg()
 
     def OnHelp(self, *_event):
+        from dicomsort.gui.dialogs import HelpDlg
+
         HelpDlg(self)
 
     def _MenuGenerator(self, parent, name, arguments):
@@ -215,10 +229,14 @@ class MainFrame(wx.Frame):
             size=(700, 500), pos=pos
         )
 
-        self.crust = wx.py.crust.Crust(self.debug)
+        from wx.py import crust
+
+        self.crust = crust.Crust(self.debug)
         self.debug.Show()
 
     def QuickRename(self, *_event):
+        from dicomsort.gui.dialogs import QuickRenameDlg
+
         self.anonList = self.prefDlg.pages['Anonymization'].anonList
         dlg = QuickRenameDlg(
             self, -1, 'Anonymize', size=(250, 160), anonList=self.anonList
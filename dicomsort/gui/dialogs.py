@@ -7,10 +7,6 @@ import wx
 from urllib.parse import quote
 
 from dicomsort.gui import icons
-from dicomsort.gui.help import helpHTML
-from dicomsort.gui.overrides import HtmlWindow
-from wx.adv import AboutBox, AboutDialogInfo
-from wx.lib.agw import hyperlink
 
 
 meta = dicomsort.Metadata
@@ -19,6 +15,10 @@ meta = dicomsort.Metadata
 class AboutDlg:
 
     def __init__(self, parent=None):
+        # The modules that only some of the dialogs need are imported when
+        # those are opened
+        from wx.adv import AboutBox, AboutDialogInfo
+
         self.info = AboutDialogInfo()
         self.info.SetIcon(icons.about.GetIcon())
 
@@ -130,6 +130,9 @@ class HelpDlg(wx.Dialog):
             style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER | wx.TAB_TRAVERSAL
         )
 
+        from dicomsort.gui.help import helpHTML
+        from dicomsort.gui.overrides import HtmlWindow
+
         self.hwin = HtmlWindow(self, -1, size=(400, 200))
 
         self.hwin.SetPage(helpHTML)
@@ -259,6 +262,8 @@ class QuickRenameDlg(wx.Dialog):
 
 class UpdateDlg(wx.Dialog):
     def __init__(self, parent, version):
+        from wx.lib.agw import hyperlink
+
         super(UpdateDlg, self).__init__(parent, size=(300, 170), style=wx.OK)
         message = ''.join([
             'A new version of {} is available.\n'.format(meta.pretty_name),
@@ -8,3 +8,18 @@ CounterEvent, EVT_COUNTER = NewEvent()
 UpdateEvent, EVT_UPDATE = NewEvent()
 
 post_event = PostEvent
+
+
+class ProgressListener:
+    def __init__(self, window):
+        """
+        Forwards the progress of a sort to a window as a CounterEvent, which
+        is safe to do from the worker threads
+        """
+        self.window = window
+
+    def __call__(self, progress):
+        event = CounterEvent(
+            Count=progress.count, total=progress.total, progress=progress
+        )
+        post_event(self.window, event)
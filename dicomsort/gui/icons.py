@@ -1,9 +1,43 @@
 # ----------------------------------------------------------------------
-# This file was generated by img2py.py
+# The image data in this file was generated by img2py.py
 #
-from wx.lib.embeddedimage import PyEmbeddedImage
+import wx
 
-main = PyEmbeddedImage(
+
+class EmbeddedImage:
+    def __init__(self, data):
+        """
+        Base64 encoded PNG data generated by img2py that is only decoded the
+        first time the image is used
+
+        The decoded image is cached so that every window sharing an icon
+        doesn't decode it again. Creating the bitmaps and icons from it is
+        cheap and doesn't tie them to a particular wx.App
+        """
+        self.data = data
+        self.image = None
+
+    def decode(self):
+        if self.image is None:
+            from wx.lib.embeddedimage import PyEmbeddedImage
+            self.image = PyEmbeddedImage(self.data).GetImage()
+
+        return self.image
+
+    def GetImage(self):
+        # Callers may modify the image so they get their own copy
+        return self.decode().Copy()
+
+    def GetBitmap(self):
+        return wx.Bitmap(self.decode())
+
+    def GetIcon(self):
+        icon = wx.Icon()
+        icon.CopyFromBitmap(self.GetBitmap())
+        return icon
+
+
+main = EmbeddedImage(
     "iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAYAAABzenr0AAAABHNCSVQICAgIfAhkiAAACMdJ"
     "REFUWIW9l2tsHFcVx3/3zsyu17uxN7sbx5s0tus0ruskdR8CUqAVKSUJVH3xUCmlLSAFFYEQ"
     "FahIiEo8BBIV4kNB4lEBUikIBBKvQgt98khaQkPtxE5LUztmHdsbx16vvY/Zedx7+GASpTRV"
@@ -48,7 +82,7 @@ main = PyEmbeddedImage(
     "29u2nbeunSjS4LXLk394jhNh24G7v3X4a8ATwOJ/DfAaKtz36TfuufIC78Zq3d9Zrevc7/+6"
     "+MQ3f3X0Y8BRIP5fA5wpDfT9yz4OhP/H2OC6Z6/3fwLCQncCOOfzIQAAAABJRU5ErkJggg==")
 
-about = PyEmbeddedImage(
+about = EmbeddedImage(
     "iVBORw0KGgoAAAANSUhEUgAAAIAAAACACAYAAADDPmHLAAAABHNCSVQICAgIfAhkiAAAIABJ"
     "REFUeJzsvfmTJdd15/e592bm2+rVXl1LV3VXo7vRIAACJEAQIiVKUFCiCDLEEUNy0JRsyzO2"
     "ZckhO2SHHf5lJkJh/QHSD7bDMx6Pggo7FKIcHsuSTYqasShIXEARO7H3it6qqmt9e2bexT/c"
@@ -1,5 +1,4 @@
 import wx
-import wx.py
 import configobj
 
 from dicomsort import config
@@ -8,7 +8,6 @@ import wx.html
 from wx.lib.mixins.listctrl import ListCtrlAutoWidthMixin, TextEditMixin
 
 from dicomsort.gui import errors, events
-from dicomsort.gui.dialogs import SeriesRemoveWarningDlg
 
 
 class FileDropTarget(wx.FileDropTarget):
@@ -456,6 +455,8 @@ class FieldSelector(wx.Panel):
             return
 
         if index == self.selected.GetCount() - 1 and self.has_default():
+            from dicomsort.gui.dialogs import SeriesRemoveWarningDlg
+
             warn = SeriesRemoveWarningDlg(None)
             warn.ShowModal()
 
@@ -0,0 +1,191 @@
+import io
+import json
+import os
+
+from dicomsort import utils
+
+# The index only caches what is on disk so durability is traded for speed:
+# the write-ahead log lets every worker read while another one writes and
+# commits don't have to wait for the disk
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS headers ('
+    ' path TEXT PRIMARY KEY,'
+    ' size INTEGER NOT NULL,'
+    ' mtime_ns INTEGER NOT NULL,'
+    ' inode INTEGER NOT NULL,'
+    ' forced INTEGER NOT NULL,'
+    ' tags TEXT,'
+    ' implicit_vr INTEGER NOT NULL,'
+    ' little_endian INTEGER NOT NULL,'
+    ' header BLOB NOT NULL)',
+)
+
+
+def file_status(filename):
+    """
+    Returns the (size, mtime_ns, inode) of a file, which identify the
+    version of the file that an index entry was created from
+    """
+    status = os.stat(filename)
+    return status.st_size, status.st_mtime_ns, status.st_ino
+
+
+def encode_header(dataset):
+    """
+    Returns the elements of a dataset encoded as they are in the file so
+    that their values are restored exactly (e.g. '1.50' of a DS rather than
+    the number it represents)
+    """
+    from pydicom.filebase import DicomBytesIO
+    from pydicom.filewriter import write_dataset
+
+    fid = DicomBytesIO()
+    fid.is_implicit_VR = dataset.is_implicit_VR
+    fid.is_little_endian = dataset.is_little_endian
+
+    write_dataset(fid, dataset)
+
+    return fid.getvalue()
+
+
+def decode_header(header, implicit_vr, little_endian):
+    from pydicom.filereader import read_dataset
+
+    return read_dataset(io.BytesIO(header), implicit_vr, little_endian)
+
+
+class IndexEntry:
+    def __init__(self, tags, header, implicit_vr=False, little_endian=True,
+                 forced=False):
+        """
+        Header of a file as stored in the index
+
+        tags is the list of keywords that were decoded or None if the entire
+        header was read. header holds the encoded elements (see
+        encode_header)
+        """
+        self.tags = None if tags is None else set(tags)
+        self.header = header
+        self.implicit_vr = implicit_vr
+        self.little_endian = little_endian
+        self.forced = forced
+
+    def covers(self, tags):
+        if self.tags is None:
+            return True
+
+        if tags is None:
+            return False
+
+        return set(tags).issubset(self.tags)
+
+    def merge_tags(self, tags):
+        """
+        Returns the tags to read so that the new entry also covers the tags
+        of this one
+        """
+        if self.tags is None or tags is None:
+            return None
+
+        return sorted(self.tags.union(tags))
+
+    def dataset(self, filename):
+        dataset = decode_header(
+            self.header, self.implicit_vr, self.little_endian
+        )
+
+        # Mimic a dataset that was read from the file
+        dataset.filename = filename
+
+        return dataset
+
+
+class HeaderIndex(utils.SQLiteFile):
+    pragmas = PRAGMAS
+    schema = SCHEMA
+
+    def __init__(self, filename):
+        """
+        On-disk cache of the headers of sorted files so that sorting the same
+        files again (e.g. with a different format) doesn't parse them
+
+        Entries are keyed by the path of the file and are only used while
+        its size, modification time and inode are unchanged, so modified or
+        replaced files are parsed again
+        """
+        super(HeaderIndex, self).__init__(filename)
+
+    def get(self, filename, status):
+        """
+        Returns the IndexEntry of a file or None if the file isn't indexed or
+        changed since it was
+        """
+        row = self.connection().execute(
+            'SELECT size, mtime_ns, inode, forced, tags, implicit_vr, '
+            'little_endian, header FROM headers WHERE path = ?',
+            (os.path.abspath(filename),)
+        ).fetchone()
+
+        if row is None or tuple(row[:3]) != tuple(status):
+            return None
+
+        tags = None if row[4] is None else json.loads(row[4])
+
+        return IndexEntry(
+            tags, row[7], implicit_vr=bool(row[5]),
+            little_endian=bool(row[6]), forced=bool(row[3])
+        )
+
+    def add(self, filename, status, dataset, tags=None):
+        """
+        Stores the header of a file that was read with the given tags
+        """
+        try:
+            header = encode_header(dataset)
+        except Exception:
+            # Files whose header can't be encoded are simply read again
+            return
+
+        # Files without a preamble have to be read with force
+        forced = getattr(dataset, 'preamble', None) is None
+
+        self.connection().execute(
+            'INSERT OR REPLACE INTO headers (path, size, mtime_ns, inode, '
+            'forced, tags, implicit_vr, little_endian, header) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                os.path.abspath(filename), status[0], status[1], status[2],
+                int(forced), None if tags is None else json.dumps(tags),
+                int(dataset.is_implicit_VR), int(dataset.is_little_endian),
+                header
+            )
+        )
+
+    def read(self, filename, specific_tags=None, legacy=False):
+        """
+        Drop-in replacement for utils.isdicom(filename, header_only=True)
+        that returns the indexed header of unchanged files
+        """
+        status = file_status(filename)
+        entry = self.get(filename, status)
+        tags = specific_tags
+
+        # Files without a preamble are only sorted if legacy files are
+        if entry is not None and (legacy or not entry.forced):
+            if entry.covers(specific_tags):
+                return entry.dataset(filename)
+
+            tags = entry.merge_tags(specific_tags)
+
+        dataset = utils.isdicom(
+            filename, header_only=True, specific_tags=tags, legacy=legacy
+        )
+
+        if dataset:
+            self.add(filename, status, dataset, tags)
+
+        return dataset
@@ -0,0 +1,181 @@
+import datetime
+import time
+
+from dicomsort import utils
+
+# Maximum number of progress reports per second
+PROGRESS_RATE = 10.0
+
+# Seconds that a worker counts files locally before merging them into the
+# statistics that are shared by all workers
+MERGE_INTERVAL = 0.05
+
+
+class Progress:
+    def __init__(self, count, total, size=0, elapsed=0.0, finished=False,
+                 queued=0):
+        """
+        Snapshot of the progress of a sort that is handed to the listeners
+
+        queued is the number of discovered files waiting for a worker. A
+        queue that stays full means that more workers could keep up
+        """
+        self.count = count
+        self.total = total
+        self.size = size
+        self.elapsed = elapsed
+        self.finished = finished
+        self.queued = queued
+
+    def throughput(self):
+        """
+        Returns the number of files that were sorted per second
+        """
+        if self.elapsed <= 0:
+            return 0.0
+
+        return self.count / self.elapsed
+
+    def bytes_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+
+        return self.size / self.elapsed
+
+    def eta(self):
+        """
+        Returns the estimated number of seconds until the sort completes or
+        None if it can't be estimated yet
+        """
+        if self.finished:
+            return 0.0
+
+        throughput = self.throughput()
+
+        if throughput <= 0:
+            return None
+
+        return max(self.total - self.count, 0) / throughput
+
+    def __str__(self):
+        summary = '{} / {} files, {:.1f} MB, {:.1f} files/s'.format(
+            self.count, self.total, self.size / 1e6, self.throughput()
+        )
+
+        eta = self.eta()
+
+        if eta is not None and not self.finished:
+            duration = datetime.timedelta(seconds=int(round(eta)))
+            summary = '{}, ETA {}'.format(summary, duration)
+
+        return summary
+
+
+class ProgressCounter:
+    def __init__(self, statistics, reporter=None, interval=MERGE_INTERVAL):
+        """
+        Counts the files sorted by a single worker
+
+        The counts are only merged into the shared statistics periodically
+        so that workers don't contend for them after every file. Each worker
+        (or the thread collecting the results of a process pool) owns its
+        counter, so counting itself doesn't need any synchronization
+        """
+        self.statistics = statistics
+        self.reporter = reporter
+        self.interval = interval
+
+        self.count = 0
+        self.size = 0
+        self.merged = time.time()
+
+    def add(self, count=1, size=0):
+        self.count += count
+        self.size += size
+
+        if time.time() - self.merged >= self.interval:
+            self.merge()
+
+    def merge(self):
+        """
+        Adds the local counts to the statistics and reports the progress
+        """
+        if self.count or self.size:
+            self.statistics.add(self.count, self.size)
+            self.count = 0
+            self.size = 0
+
+        self.merged = time.time()
+
+        if self.reporter is not None:
+            self.reporter.update()
+
+
+class ProgressReporter(utils.Locked):
+    def __init__(self, callback, statistics, discovery=None,
+                 rate=PROGRESS_RATE):
+        """
+        Passes the progress of a sort to callback at most rate times per
+        second so that listeners aren't flooded with an update for every
+        file. The final progress is always reported
+
+        The callback can be any callable that accepts a Progress. It is
+        called from the worker threads, so GUI listeners have to hand the
+        progress over to their event loop (see gui.events.ProgressListener)
+        """
+        super(ProgressReporter, self).__init__()
+
+        self.callback = callback
+        self.statistics = statistics
+        self.discovery = discovery
+        self.interval = 1.0 / rate if rate else 0.0
+
+        # Time of the latest report
+        self.reported = 0.0
+
+        # Set once the final progress was reported
+        self.done = False
+
+    def is_finished(self):
+        if self.discovery is not None and not self.discovery.finished:
+            return False
+
+        return self.statistics.completed() >= self.statistics.total
+
+    def snapshot(self):
+        statistics = self.statistics
+
+        return Progress(
+            statistics.processed, statistics.total, statistics.bytes,
+            statistics.elapsed(), finished=self.is_finished(),
+            queued=statistics.queue_depth()
+        )
+
+    def update(self):
+        """
+        Reports the progress unless that was already done recently. Returns
+        whether the callback was called
+        """
+        finished = self.is_finished()
+
+        if not finished and time.time() - self.reported < self.interval:
+            return False
+
+        # Another worker is already reporting (the final report waits)
+        if not self.lock.acquire(blocking=finished):
+            return False
+
+        try:
+            now = time.time()
+
+            if self.done or \
+                    (not finished and now - self.reported < self.interval):
+                return False
+
+            self.done = finished
+            self.reported = now
+            self.callback(self.snapshot())
+        finally:
+            self.lock.release()
+
+        return True
@@ -0,0 +1,221 @@
+import contextlib
+import functools
+import hashlib
+import hmac
+import secrets
+
+from dicomsort import utils
+
+STRATEGIES = ('hash', 'counter')
+
+# Number of hexadecimal digits of the keyed hash that are used
+HASH_LENGTH = 16
+
+# Number of digits of counter-based pseudonyms (e.g. 000042)
+COUNTER_WIDTH = 6
+
+# Number of pseudonyms each worker keeps in memory
+CACHE_SIZE = 4096
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS pseudonyms ('
+    ' namespace TEXT NOT NULL,'
+    ' source TEXT NOT NULL,'
+    ' pseudonym TEXT NOT NULL,'
+    ' number INTEGER,'
+    ' PRIMARY KEY (namespace, source))',
+    'CREATE TABLE IF NOT EXISTS settings ('
+    ' name TEXT PRIMARY KEY,'
+    ' value TEXT NOT NULL)',
+)
+
+
+class PseudonymStore(utils.SQLiteFile):
+    schema = SCHEMA
+
+    def __init__(self, filename):
+        """
+        On-disk mapping of source IDs to pseudonyms so that repeated runs
+        (and all worker processes of a run) use the same pseudonyms
+        """
+        super(PseudonymStore, self).__init__(filename)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            yield connection
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        connection.execute('COMMIT')
+
+    def secret(self):
+        """
+        Returns the key used for hash-based pseudonyms, which is created the
+        first time the store is used
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)',
+                ('secret', secrets.token_hex(32))
+            )
+            row = connection.execute(
+                'SELECT value FROM settings WHERE name = ?', ('secret',)
+            ).fetchone()
+
+        return bytes.fromhex(row[0])
+
+    def get(self, namespace, source):
+        row = self.connection().execute(
+            'SELECT pseudonym FROM pseudonyms '
+            'WHERE namespace = ? AND source = ?', (namespace, source)
+        ).fetchone()
+
+        return None if row is None else row[0]
+
+    def add(self, namespace, source, pseudonym):
+        """
+        Stores a pseudonym unless the source already has one and returns the
+        pseudonym that is stored
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO pseudonyms (namespace, source, '
+                'pseudonym) VALUES (?, ?, ?)', (namespace, source, pseudonym)
+            )
+
+        return self.get(namespace, source)
+
+    def assign(self, namespace, source, prefix='', width=COUNTER_WIDTH):
+        """
+        Returns the pseudonym of source, assigning it the next number of the
+        namespace if it doesn't have one yet
+        """
+        with self.transaction() as connection:
+            row = connection.execute(
+                'SELECT pseudonym FROM pseudonyms '
+                'WHERE namespace = ? AND source = ?', (namespace, source)
+            ).fetchone()
+
+            if row is not None:
+                return row[0]
+
+            number, = connection.execute(
+                'SELECT COALESCE(MAX(number), 0) + 1 FROM pseudonyms '
+                'WHERE namespace = ?', (namespace,)
+            ).fetchone()
+
+            pseudonym = '{}{:0{}d}'.format(prefix, number, width)
+
+            connection.execute(
+                'INSERT INTO pseudonyms (namespace, source, pseudonym, '
+                'number) VALUES (?, ?, ?, ?)',
+                (namespace, source, pseudonym, number)
+            )
+
+        return pseudonym
+
+
+class Pseudonymizer(utils.Locked):
+    def __init__(self, field='PatientID', strategy='hash', prefix='',
+                 store=None, key=None, length=HASH_LENGTH,
+                 width=COUNTER_WIDTH, cache_size=CACHE_SIZE):
+        """
+        Anonymization replacement that maps each value of field to a stable
+        pseudonym
+
+        The hash strategy uses a keyed hash (HMAC-SHA256) so every worker
+        computes the same pseudonym independently. The counter strategy
+        numbers the values in the order they are encountered. Without a
+        store every process numbers them on its own, so different values
+        would get the same pseudonym in separate processes. Pseudonyms are
+        kept in an LRU cache so that the files of a patient don't need to
+        recompute or look them up again
+        """
+        super(Pseudonymizer, self).__init__()
+
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown pseudonym strategy: {}'.format(strategy))
+
+        self.field = field
+        self.strategy = strategy
+        self.prefix = prefix
+        self.store = store
+        self.length = length
+        self.width = width
+        self.cache_size = cache_size
+
+        # Resolve the key now so that pickled copies all use the same one
+        if strategy == 'hash' and key is None:
+            key = secrets.token_bytes(32) if store is None else store.secret()
+
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+
+        self.key = key
+
+        # Numbers handed out by the counter strategy when there is no store
+        self.numbers = dict()
+
+        self.cached = functools.lru_cache(maxsize=cache_size)(self.create)
+
+    def __getstate__(self):
+        state = super(Pseudonymizer, self).__getstate__()
+        del state['cached']
+        return state
+
+    def __setstate__(self, state):
+        super(Pseudonymizer, self).__setstate__(state)
+        self.cached = functools.lru_cache(maxsize=self.cache_size)(
+            self.create
+        )
+
+    def __call__(self, value):
+        value = str(value)
+
+        # There is nothing to hide in an empty value
+        if value == '':
+            return value
+
+        return self.cached(value)
+
+    def is_consistent(self):
+        """
+        Returns whether copies in other processes hand out the same
+        pseudonyms as this one
+        """
+        return self.strategy != 'counter' or self.store is not None
+
+    def digest(self, value):
+        digest = hmac.new(self.key, value.encode('utf-8'), hashlib.sha256)
+        return self.prefix + digest.hexdigest()[:self.length]
+
+    def count(self, value):
+        with self.lock:
+            if value not in self.numbers:
+                self.numbers[value] = len(self.numbers) + 1
+
+            number = self.numbers[value]
+
+        return '{}{:0{}d}'.format(self.prefix, number, self.width)
+
+    def create(self, value):
+        if self.strategy == 'counter':
+            if self.store is None:
+                return self.count(value)
+
+            return self.store.assign(
+                self.field, value, self.prefix, self.width
+            )
+
+        pseudonym = self.digest(value)
+
+        # Record the mapping so the pseudonyms can be traced back later
+        if self.store is not None:
+            pseudonym = self.store.add(self.field, value, pseudonym)
+
+        return pseudonym
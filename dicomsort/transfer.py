@@ -0,0 +1,189 @@
+import errno
+import os
+import shutil
+import sys
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request that clones the extents of a file on Linux (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# Errors indicating that a strategy can't work for this platform or pair of
+# filesystems (as opposed to a problem with a specific file)
+UNSUPPORTED_ERRORS = {
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EPERM,
+    errno.EXDEV,
+}
+
+# Number of bytes copied per system call by the kernel copy
+KERNEL_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def temporary_name(destination):
+    """
+    Returns a hidden, unique filename in the same directory as destination
+    """
+    directory, filename = os.path.split(destination)
+    token = uuid.uuid4().hex[:12]
+    return os.path.join(directory, '.{}.{}.tmp'.format(filename, token))
+
+
+def replace(destination, create):
+    """
+    Calls create with a temporary path and atomically moves the result to
+    destination, replacing the empty file reserved for it
+    """
+    temporary = temporary_name(destination)
+    create(temporary)
+
+    try:
+        os.replace(temporary, destination)
+    except OSError:
+        os.remove(temporary)
+        raise
+
+
+def copy(source, destination):
+    shutil.copy(source, destination)
+
+
+def hardlink(source, destination):
+    replace(destination, lambda path: os.link(source, path))
+
+
+def symlink(source, destination):
+    source = os.path.abspath(source)
+    replace(destination, lambda path: os.symlink(source, path))
+
+
+def reflink(source, destination):
+    """
+    Creates a copy-on-write clone that shares the data blocks of the source
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOTSUP, 'Reflinks are not supported', source)
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def kernel_copy(source, destination):
+    """
+    Copies the data within the kernel without passing it through userspace
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+
+    if copy_file_range is None and sendfile is None:
+        raise OSError(errno.ENOTSUP, 'Kernel copies are not supported', source)
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+
+        while offset < size:
+            count = min(KERNEL_CHUNK_SIZE, size - offset)
+
+            if copy_file_range is not None:
+                copied = copy_file_range(src.fileno(), dst.fileno(), count)
+            else:
+                copied = sendfile(dst.fileno(), src.fileno(), offset, count)
+
+            if copied == 0:
+                break
+
+            offset += copied
+
+
+STRATEGIES = {
+    'copy': copy,
+    'hardlink': hardlink,
+    'kernel': kernel_copy,
+    'reflink': reflink,
+    'symlink': symlink,
+}
+
+# Strategies that are tried (in order) for each mode. Every mode falls back
+# to a regular copy
+FALLBACKS = {
+    'auto': ['reflink', 'kernel', 'copy'],
+    'copy': ['copy'],
+    'hardlink': ['hardlink', 'copy'],
+    'kernel': ['kernel', 'copy'],
+    'reflink': ['reflink', 'kernel', 'copy'],
+    'symlink': ['symlink', 'copy'],
+}
+
+MODES = sorted(FALLBACKS)
+
+# Strategies that leave the destination dependent on the source and can
+# therefore not be used when the source is removed afterwards
+LINK_STRATEGIES = ('hardlink', 'symlink')
+
+
+class Transfer:
+    def __init__(self, mode='copy'):
+        """
+        Transfers files to their destination using the fastest strategy of
+        the requested mode that works
+
+        Strategies that fail because they aren't supported are skipped for
+        the remainder of the sort
+        """
+        if mode not in FALLBACKS:
+            raise ValueError('Unknown transfer mode: {}'.format(mode))
+
+        self.mode = mode
+        self.strategies = FALLBACKS[mode]
+        self.unsupported = set()
+
+    def transfer(self, strategies, source, destination):
+        strategies = [s for s in strategies if s not in self.unsupported]
+
+        for strategy in strategies[:-1]:
+            try:
+                STRATEGIES[strategy](source, destination)
+                return strategy
+            except OSError as exc:
+                if exc.errno in UNSUPPORTED_ERRORS:
+                    self.unsupported.add(strategy)
+
+        strategy = strategies[-1]
+        STRATEGIES[strategy](source, destination)
+
+        return strategy
+
+    def __call__(self, source, destination):
+        """
+        Transfers a file and returns the name of the strategy that was used
+        """
+        return self.transfer(self.strategies, source, destination)
+
+    def move(self, source, destination):
+        """
+        Moves a file, which is a simple rename if the source and destination
+        are on the same filesystem. Otherwise the file is copied with the
+        strategies of this mode (excluding links) and the source is removed
+        """
+        try:
+            os.replace(source, destination)
+            return 'rename'
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+
+        strategies = [s for s in self.strategies if s not in LINK_STRATEGIES]
+        strategy = self.transfer(strategies, source, destination)
+
+        os.remove(source)
+
+        return strategy
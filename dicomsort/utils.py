@@ -1,12 +1,34 @@
 import os
-import pydicom
 import re
+import sqlite3
 import sys
+import threading
 
-from pydicom.errors import InvalidDicomError
+from threading import Lock
 
 INVALID_FILENAME_CHARS = re.compile('[\\\\/\\:\\*\\?\\"\\<\\>\\|]+')
 
+FORMAT_TOKEN = re.compile('%\\(([^)]*)\\)')
+
+# Maximum number of times nested tokens are replaced so that self-referencing
+# values can't cause an infinite loop
+MAX_REPLACEMENTS = 5
+
+# Elements larger than this are only read from disk when they are accessed
+DEFER_SIZE = '1 KB'
+
+# DICOM files start with a 128 byte preamble followed by this prefix
+PREAMBLE_LENGTH = 128
+DICOM_PREFIX = b'DICM'
+
+# Files written without a preamble usually start with an element of one of
+# these groups (little endian)
+LEGACY_GROUPS = (b'\x02\x00', b'\x08\x00')
+
+# Seconds to wait for other threads or processes that are writing to a
+# SQLite file
+SQLITE_TIMEOUT = 30.0
+
 if sys.platform == 'win32':
     DIRECTORY_EXISTS_EXCEPTION = WindowsError
 else:
@@ -20,8 +42,178 @@ def mkdir(directory):
         return
 
 
+class Locked:
+    """
+    Base class for objects that guard their state with a lock and can still
+    be pickled to send them to worker processes
+    """
+    def __init__(self):
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+
+class SQLiteFile:
+    # Statements that are executed whenever a connection is opened
+    pragmas = ()
+    schema = ()
+
+    def __init__(self, filename):
+        """
+        Base class for SQLite files that are shared by the workers of a sort
+
+        Each thread opens its own connection and SQLite coordinates the
+        writers, so instances can be used by many threads without any locks
+        of our own. Only the filename is pickled to send them to worker
+        processes, which open their own connections
+        """
+        self.filename = filename
+        self.local = threading.local()
+
+    def __getstate__(self):
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+            # Transactions are started explicitly where they are needed
+            connection = sqlite3.connect(
+                self.filename, timeout=SQLITE_TIMEOUT, isolation_level=None
+            )
+
+            for statement in self.pragmas + self.schema:
+                connection.execute(statement)
+
+            self.local.connection = connection
+
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+class DirectoryCache(Locked):
+    def __init__(self, root=None):
+        """
+        Keeps track of the output directories that already exist so that
+        each one is only created once per sort
+
+        The directories below root are added the first time the cache is
+        used so sorting into a non-empty directory doesn't recreate them.
+        Each thread or process may use its own instance since creating a
+        directory that another one just created is not an error
+        """
+        super(DirectoryCache, self).__init__()
+
+        self.root = root
+        self.seeded = root is None
+        self.directories = set()
+
+    def seed(self):
+        with self.lock:
+            if self.seeded:
+                return
+
+            for root, _, _ in os.walk(self.root):
+                self.directories.add(root)
+
+            self.seeded = True
+
+    def mkdir(self, directory):
+        if not self.seeded:
+            self.seed()
+
+        if directory in self.directories:
+            return
+
+        mkdir(directory)
+
+        # Don't remember directories that couldn't be created
+        if os.path.isdir(directory):
+            with self.lock:
+                self.directories.add(directory)
+
+
+def copy_name(destination, copies):
+    """
+    Returns the name of the n-th copy of a destination. Numbering the copies
+    keeps the names short even if many files collide
+    """
+    if copies == 0:
+        return destination
+
+    if copies == 1:
+        return destination + '.copy'
+
+    return '{}.copy{}'.format(destination, copies)
+
+
+class DestinationRegistry(Locked):
+    def __init__(self):
+        """
+        Assigns unique output filenames by appending .copy, .copy2, ... to
+        destinations that are already taken
+
+        Each destination is claimed by exclusively creating an empty file so
+        that concurrent workers (even in other processes) never write to the
+        same file. The number of copies is remembered for every destination
+        that collided so the next one is found without probing the disk
+        """
+        super(DestinationRegistry, self).__init__()
+
+        self.copies = dict()
+
+    def reserve(self, destination):
+        while True:
+            with self.lock:
+                copies = self.copies.get(destination, 0)
+
+                if copies:
+                    self.copies[destination] = copies + 1
+
+            candidate = copy_name(destination, copies)
+
+            try:
+                fid = os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                with self.lock:
+                    copies = max(self.copies.get(destination, 0), copies + 1)
+                    self.copies[destination] = copies
+
+                continue
+
+            os.close(fid)
+
+            return candidate
+
+    def release(self, destination):
+        """
+        Removes a reserved destination that couldn't be written so that no
+        empty or partially written file is left behind
+        """
+        try:
+            os.remove(destination)
+        except FileNotFoundError:
+            pass
+
+
 def recursive_replace_tokens(formatString, repobj):
-    max_rep = 5
+    max_rep = MAX_REPLACEMENTS
     rep = 0
 
     while re.search('%\\(.*\\)', formatString) and rep < max_rep:
@@ -31,6 +223,70 @@ def recursive_replace_tokens(formatString, repobj):
     return formatString
 
 
+def format_fields(formatString):
+    """
+    Returns the set of fields referenced by the %(...)s tokens of a string
+    """
+    return set(FORMAT_TOKEN.findall(formatString))
+
+
+class FormatTemplate:
+    def __init__(self, format_string, replacements=None):
+        """
+        A format string that is parsed once and can then be rendered for
+        many files
+
+        Any %(Key)s token whose replacement is itself a format string is
+        expanded up front so that nested tokens don't require additional
+        formatting passes per file
+        """
+        self.format_string = format_string
+        self.template = self._expand(format_string, replacements or dict())
+        self.fields = format_fields(self.template)
+
+    @staticmethod
+    def _expand(format_string, replacements):
+        nested = {
+            key: value for key, value in replacements.items()
+            if isinstance(value, str) and FORMAT_TOKEN.search(value)
+        }
+
+        for _ in range(MAX_REPLACEMENTS - 1):
+            expanded = format_string
+
+            for key, value in nested.items():
+                expanded = expanded.replace('%({})s'.format(key), value)
+
+            if expanded == format_string:
+                break
+
+            format_string = expanded
+
+        return format_string
+
+    def render(self, values):
+        if not self.fields:
+            return self.template
+
+        output = self.template % values
+
+        # Values that weren't known at compile time may contain tokens
+        rep = 1
+        while '%(' in output and FORMAT_TOKEN.search(output) and \
+                rep < MAX_REPLACEMENTS:
+            output = output % values
+            rep = rep + 1
+
+        return output
+
+
+def compile_format(format_string, replacements=None):
+    if isinstance(format_string, FormatTemplate):
+        return format_string
+
+    return FormatTemplate(format_string, replacements)
+
+
 def clean_directory_name(path):
     return re.sub(INVALID_FILENAME_CHARS, '_', path)
 
@@ -47,10 +303,70 @@ def clean_path(path):
     return os.path.join(head, outpath)[:-1]
 
 
-def isdicom(filename):
+def read_header(filename, specific_tags=None, force=False):
+    """
+    Reads everything but the pixel data, deferring any large elements
+
+    If specific_tags is provided, only those elements are decoded
+    """
+    # pydicom is slow to import so it isn't loaded until a file is parsed
+    import pydicom
+
+    return pydicom.read_file(
+        filename, stop_before_pixels=True, defer_size=DEFER_SIZE,
+        specific_tags=specific_tags, force=force
+    )
+
+
+def sniff(filename, legacy=False):
+    """
+    Cheaply checks the first bytes of a file to determine whether it is worth
+    parsing. Returns 'dicom' if the DICM prefix is present, 'legacy' if legacy
+    is True and the file looks like it starts with a DICOM element, and None
+    otherwise
+    """
+    with open(filename, 'rb') as fid:
+        header = fid.read(PREAMBLE_LENGTH + len(DICOM_PREFIX))
+
+    if header[PREAMBLE_LENGTH:] == DICOM_PREFIX:
+        return 'dicom'
+
+    if legacy and header[:2] in LEGACY_GROUPS:
+        return 'legacy'
+
+    return None
+
+
+def isdicom(filename, header_only=False, specific_tags=None, legacy=False):
+    """
+    Returns the parsed dataset or False if the file is not a DICOM file
+
+    Files without the DICM prefix are rejected before they are parsed unless
+    legacy is True, in which case preamble-less files are parsed as well
+    """
     if os.path.basename(filename).lower() == 'dicomdir':
         return False
+
+    kind = sniff(filename, legacy)
+
+    if kind is None:
+        return False
+
+    force = kind == 'legacy'
+
+    import pydicom
+    from pydicom.errors import InvalidDicomError
+
     try:
-        return pydicom.read_file(filename)
+        if header_only:
+            dataset = read_header(filename, specific_tags, force)
+        else:
+            dataset = pydicom.read_file(filename, force=force)
     except InvalidDicomError:
         return False
+
+    # Forcing pydicom to read a file that isn't DICOM yields no elements
+    if force and len(dataset) == 0:
+        return False
+
+    return dataset
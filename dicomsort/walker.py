@@ -0,0 +1,124 @@
+import os
+
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+
+# Number of directories that are listed concurrently
+WALK_THREADS = 8
+
+# Maximum number of directory listings waiting to be consumed
+BATCH_QUEUE_SIZE = 64
+
+# How often blocked threads check whether the walk was abandoned
+POLL_INTERVAL = 0.1
+
+
+def scan_directory(directory):
+    """
+    Lists a directory and returns its files and the subdirectories to descend
+    into. Symbolic links to directories are not followed (like os.walk)
+    """
+    files = list()
+    subdirectories = list()
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # DirEntry caches the file type so this usually doesn't
+                # require an additional stat call
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if not is_dir:
+                    files.append(entry.path)
+                elif not entry.is_symlink():
+                    subdirectories.append(entry.path)
+    except OSError:
+        # Unreadable directories are skipped just like os.walk does
+        pass
+
+    return files, subdirectories
+
+
+class TreeWalker:
+    def __init__(self, paths, threads=WALK_THREADS):
+        """
+        Iterates over every file below the given paths while multiple threads
+        list the subdirectories concurrently. Files are yielded in no
+        particular order
+        """
+        self.paths = list(paths)
+        self.threads = max(1, threads)
+
+        self.directories = Queue()
+        self.batches = Queue(BATCH_QUEUE_SIZE)
+
+        # Directories that are queued or being listed
+        self.pending = len(self.paths)
+        self.lock = Lock()
+
+        self.stopped = Event()
+
+    def put_batch(self, batch):
+        while not self.stopped.is_set():
+            try:
+                self.batches.put(batch, timeout=POLL_INTERVAL)
+                return
+            except Full:
+                continue
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                directory = self.directories.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+
+            files, subdirectories = scan_directory(directory)
+
+            with self.lock:
+                self.pending += len(subdirectories)
+
+            for subdirectory in subdirectories:
+                self.directories.put(subdirectory)
+
+            if files:
+                self.put_batch(files)
+
+            with self.lock:
+                self.pending -= 1
+                finished = self.pending == 0
+
+            if finished:
+                self.put_batch(None)
+
+    def __iter__(self):
+        if not self.paths:
+            return
+
+        for path in self.paths:
+            self.directories.put(path)
+
+        for _ in range(self.threads):
+            thread = Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                batch = self.batches.get()
+
+                if batch is None:
+                    return
+
+                for filename in batch:
+                    yield filename
+        finally:
+            # Also stops the threads if the caller stops iterating early
+            self.stopped.set()
+
+
+def walk_files(paths, threads=WALK_THREADS):
+    return iter(TreeWalker(paths, threads))
@@ -18,4 +18,9 @@ if __name__ == '__main__':
         scripts=[
             os.path.join('bin', 'dicomsort')
         ],
+        entry_points={
+            'console_scripts': [
+                'dicomsort-cli = dicomsort.cli:main',
+            ],
+        },
     )
@@ -1,5 +1,7 @@
 import pytest
 
+from dicomsort import utils
+
 from pydicom.dataset import FileDataset, FileMetaDataset
 
 
@@ -28,3 +30,20 @@ def dicom_generator(tmpdir):
         return filename, ds
 
     return _dicom
+
+
+@pytest.fixture(scope='session')
+def strip_preamble():
+    def _strip(filename):
+        """
+        Removes the preamble and DICM prefix to create a legacy file
+        """
+        with open(filename, 'rb') as fid:
+            contents = fid.read()
+
+        offset = utils.PREAMBLE_LENGTH + len(utils.DICOM_PREFIX)
+
+        with open(filename, 'wb') as fid:
+            fid.write(contents[offset:])
+
+    return _strip
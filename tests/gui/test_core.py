@@ -1,9 +1,45 @@
 import os
+import subprocess
 
 from dicomsort.gui.core import MainFrame, sys, wx, errors
 from dicomsort.gui.events import CounterEvent, SortEvent, PathEvent
+from dicomsort.progress import Progress
 from tests.shared import WxTestCase
 
+# Maximum number of seconds that importing the GUI may take on top of wx
+IMPORT_BUDGET = 1.0
+
+IMPORT_TIME_SCRIPT = """
+import sys, time, wx
+start = time.perf_counter()
+import dicomsort.gui.core
+print(time.perf_counter() - start)
+print(' '.join(sys.modules))
+"""
+
+# Modules that aren't needed until a file is parsed or a dialog is opened
+DEFERRED_MODULES = [
+    'dicomsort.gui.dialogs',
+    'dicomsort.gui.help',
+    'pydicom',
+    'wx.lib.agw.hyperlink',
+    'wx.lib.agw.multidirdialog',
+    'wx.py.crust',
+]
+
+
+def test_import_time():
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_TIME_SCRIPT], universal_newlines=True
+    )
+    elapsed, modules = output.splitlines()
+    modules = modules.split()
+
+    assert float(elapsed) < IMPORT_BUDGET
+
+    for module in DEFERRED_MODULES:
+        assert module not in modules
+
 
 class TestMainFrame(WxTestCase):
     def test_on_quit(self, mocker):
@@ -33,6 +69,23 @@ class TestMainFrame(WxTestCase):
 
         frame.Close()
 
+    def test_on_count_progress(self, mocker):
+        mocker.patch.object(sys, 'exit')
+        frame = MainFrame(self.frame)
+        frame.Show()
+
+        mock = mocker.patch.object(frame, 'SetStatusText')
+
+        progress = Progress(2, 42, size=2000000, elapsed=1.0)
+        event = CounterEvent(Count=2, total=42, progress=progress)
+
+        frame.OnCount(event)
+        mock.assert_called_once_with(
+            '2 / 42 files, 2.0 MB, 2.0 files/s, ETA 0:00:20'
+        )
+
+        frame.Close()
+
     def test_on_about(self, mocker):
         mocker.patch.object(sys, 'exit')
         frame = MainFrame(self.frame)
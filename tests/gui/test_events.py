@@ -0,0 +1,19 @@
+from dicomsort.gui import events
+from dicomsort.progress import Progress
+
+
+class TestProgressListener:
+    def test_call(self, mocker):
+        post_event = mocker.patch.object(events, 'post_event')
+
+        listener = events.ProgressListener('window')
+        progress = Progress(2, 42)
+
+        listener(progress)
+
+        window, event = post_event.call_args[0]
+
+        assert window == 'window'
+        assert event.Count == 2
+        assert event.total == 42
+        assert event.progress is progress
@@ -0,0 +1,37 @@
+from dicomsort.gui import icons
+from dicomsort.gui.icons import EmbeddedImage, wx
+from tests.shared import WxTestCase
+
+
+class TestEmbeddedImage(WxTestCase):
+    def test_not_decoded(self):
+        image = EmbeddedImage(icons.about.data)
+
+        assert image.image is None
+
+    def test_get_icon(self):
+        image = EmbeddedImage(icons.main.data)
+
+        icon = image.GetIcon()
+
+        assert isinstance(icon, wx.Icon)
+        assert icon.IsOk()
+        assert icon.GetWidth() == 32
+
+    def test_decoded_once(self, mocker):
+        image = EmbeddedImage(icons.main.data)
+        decoded = image.decode()
+
+        mock = mocker.patch('wx.lib.embeddedimage.PyEmbeddedImage')
+
+        image.GetIcon()
+        image.GetBitmap()
+
+        mock.assert_not_called()
+        assert image.decode() is decoded
+
+    def test_get_image_copy(self):
+        image = EmbeddedImage(icons.main.data)
+
+        assert image.GetImage() is not image.decode()
+        assert image.GetImage().GetSize() == image.decode().GetSize()
@@ -0,0 +1,206 @@
+import os
+import pickle
+import pydicom
+import pytest
+
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+from dicomsort import anonymization
+
+
+class TestAnonymizationRules:
+    def test_invalid_input(self):
+        with pytest.raises(Exception) as excinfo:
+            anonymization.AnonymizationRules('')
+
+        assert excinfo.value.args[0] == 'Anon rules must be a dictionary'
+
+    def test_constants(self):
+        rules = anonymization.AnonymizationRules({
+            'PatientName': 'ANON',
+            'PatientID': '100%%',
+        })
+
+        assert rules.constants == {'PatientName': 'ANON', 'PatientID': '100%'}
+        assert rules.templates == dict()
+
+    def test_templates(self):
+        rules = anonymization.AnonymizationRules({
+            'PatientName': 'ANON',
+            'PatientID': '%(PatientName)s_%(StudyID)s',
+        })
+
+        assert list(rules.constants) == ['PatientName']
+        assert list(rules.templates) == ['PatientID']
+        assert rules.templates['PatientID'].fields == {
+            'PatientName', 'StudyID'
+        }
+
+    def test_values(self):
+        rules = anonymization.AnonymizationRules({
+            'PatientName': 'ANON',
+            'PatientID': '%(PatientName)s_%(StudyID)s',
+        })
+
+        # Replacements are looked up through the overrides of the file
+        values = rules.values({'PatientName': 'ANON', 'StudyID': '7'})
+
+        assert values == {'PatientName': 'ANON', 'PatientID': 'ANON_7'}
+
+    def test_derived_values(self):
+        rules = anonymization.AnonymizationRules({'PatientBirthDate': ''})
+
+        assert rules.derived == ('PatientBirthDate',)
+
+        values = rules.values({'PatientBirthDate': '19890101'})
+
+        assert values == {'PatientBirthDate': '19890101'}
+
+    def test_immutable(self):
+        lookup = {'PatientName': 'ANON'}
+        rules = anonymization.AnonymizationRules(lookup)
+
+        # Changing the original dictionary doesn't affect the rules
+        lookup['PatientName'] = 'Changed'
+        assert rules.lookup['PatientName'] == 'ANON'
+
+        with pytest.raises(TypeError):
+            rules.lookup['PatientName'] = 'Changed'
+
+        with pytest.raises(TypeError):
+            rules.constants['PatientName'] = 'Changed'
+
+    def test_pickle(self):
+        rules = anonymization.AnonymizationRules({
+            'PatientName': 'ANON',
+            'PatientID': '%(PatientName)s_%(StudyID)s',
+        })
+
+        restored = pickle.loads(pickle.dumps(rules))
+
+        assert restored.lookup == rules.lookup
+        assert restored.constants == {'PatientName': 'ANON'}
+        assert list(restored.templates) == ['PatientID']
+
+        # The restored rules are still read-only
+        with pytest.raises(TypeError):
+            restored.lookup['PatientName'] = 'Changed'
+
+    def test_empty(self):
+        assert bool(anonymization.AnonymizationRules(dict())) is False
+        assert bool(anonymization.AnonymizationRules({'Key': 'V'})) is True
+
+
+class TestApplyReplacements:
+    def test_existing_element(self, dicom_generator):
+        _, dataset = dicom_generator(PatientName='Suever')
+
+        anonymization.apply_replacements(dataset, {'PatientName': 'ANON'})
+
+        assert dataset.PatientName == 'ANON'
+
+    def test_missing_element(self, dicom_generator):
+        _, dataset = dicom_generator()
+
+        anonymization.apply_replacements(dataset, {'PatientID': 'ANON'})
+
+        assert 'PatientID' not in dataset
+
+    def test_invalid_keyword(self, dicom_generator):
+        _, dataset = dicom_generator()
+        expected = dataset.dir('')
+
+        anonymization.apply_replacements(dataset, {'Invalid': 'ANON'})
+
+        assert dataset.dir('') == expected
+
+
+class TestWriteAnonymized:
+    def test_header(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(PatientName='Suever', PatientID='ID')
+        destination = str(tmpdir.join('anonymized'))
+
+        values = {'PatientName': 'ANON', 'PatientBirthDate': '20200101'}
+        anonymization.write_anonymized(filename, destination, values)
+
+        dataset = pydicom.read_file(destination)
+
+        assert dataset.PatientName == 'ANON'
+        assert dataset.PatientID == 'ID'
+        assert 'PatientBirthDate' not in dataset
+
+    def test_pixel_data_is_streamed(self, dicom_generator, tmpdir):
+        pixels = bytes(range(256)) * 4
+        filename, _ = dicom_generator(
+            PatientName='Suever', BitsAllocated=8, PixelData=pixels
+        )
+        destination = str(tmpdir.join('anonymized'))
+
+        anonymization.write_anonymized(
+            filename, destination, {'PatientName': 'A'}
+        )
+
+        with open(filename, 'rb') as fid:
+            original = fid.read()
+
+        with open(destination, 'rb') as fid:
+            anonymized = fid.read()
+
+        # Everything from the pixel data onwards is identical
+        tail = len(pixels) + 12
+        assert anonymized[-tail:] == original[-tail:]
+
+        # The shorter name shrinks the file
+        assert len(anonymized) < len(original)
+
+        assert pydicom.read_file(destination).PixelData == pixels
+
+    def test_trailing_elements(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(
+            BitsAllocated=8,
+            PixelData=b'\1' * 64,
+            DataSetTrailingPadding=b'\0' * 8,
+        )
+        destination = str(tmpdir.join('anonymized'))
+
+        anonymization.write_anonymized(
+            filename, destination, {'PatientName': 'ANON'}
+        )
+
+        dataset = pydicom.read_file(destination)
+
+        assert dataset.PixelData == b'\1' * 64
+        assert dataset.DataSetTrailingPadding == b'\0' * 8
+
+    def test_no_pixel_data(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(PatientName='Suever')
+        destination = str(tmpdir.join('anonymized'))
+
+        anonymization.write_anonymized(
+            filename, destination, {'PatientName': 'ANON'}
+        )
+
+        dataset = pydicom.read_file(destination)
+
+        assert dataset.PatientName == 'ANON'
+        assert 'PixelData' not in dataset
+
+    def test_deflated(self, dicom_generator, tmpdir):
+        filename, dataset = dicom_generator(
+            PatientName='Suever', BitsAllocated=8, PixelData=b'\1' * 64
+        )
+
+        dataset.file_meta.TransferSyntaxUID = DeflatedExplicitVRLittleEndian
+        dataset.save_as(filename)
+
+        destination = str(tmpdir.join('anonymized'))
+
+        anonymization.write_anonymized(
+            filename, destination, {'PatientName': 'ANON'}
+        )
+
+        dataset = pydicom.read_file(destination)
+
+        assert dataset.PatientName == 'ANON'
+        assert dataset.PixelData == b'\1' * 64
+        assert os.path.getsize(destination) > 0
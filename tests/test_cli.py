@@ -0,0 +1,253 @@
+import os
+import pydicom
+import pytest
+import subprocess
+import sys
+
+from queue import Queue
+
+from dicomsort import cli, config
+from dicomsort.dicomsorter import SortStatistics
+from dicomsort.pseudonyms import Pseudonymizer
+
+# Maximum number of seconds that importing the command line interface may
+# take (it is typically below 0.1 s)
+IMPORT_BUDGET = 0.5
+
+IMPORT_TIME_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import dicomsort.cli
+print(time.perf_counter() - start)
+print(' '.join(sys.modules))
+"""
+
+
+class TestParseReplacement:
+    def test_replacement(self):
+        assert cli.parse_replacement('PatientName=ANON') == \
+            ('PatientName', 'ANON')
+
+    def test_empty_replacement(self):
+        assert cli.parse_replacement('PatientName=') == ('PatientName', '')
+
+    def test_invalid(self):
+        with pytest.raises(Exception):
+            cli.parse_replacement('PatientName')
+
+
+class TestConfiguredRules:
+    def test_default(self, tmpdir):
+        rules = cli.configured_rules(str(tmpdir.join('missing.ini')))
+
+        anonymization = config.default_configuration['Anonymization']
+
+        assert sorted(rules) == sorted(anonymization['Fields'])
+        assert rules['PatientName'] == 'ANONYMOUS'
+        assert rules['PatientBirthDate'] == ''
+
+    def test_configuration_file(self, tmpdir):
+        filename = tmpdir.join('config.ini')
+        filename.write('\n'.join([
+            '[Anonymization]',
+            'Fields = PatientName, PatientID',
+            '[[Replacements]]',
+            'PatientName = Someone',
+        ]))
+
+        rules = cli.configured_rules(str(filename))
+
+        assert rules == {'PatientName': 'Someone', 'PatientID': ''}
+
+
+class TestCreateSorter:
+    def test_defaults(self):
+        args = cli.create_parser().parse_args(['input', '-o', 'output'])
+        sorter = cli.create_sorter(args)
+
+        assert sorter.pathname == ['input']
+        assert sorter.folders == []
+        assert sorter.filename == config.default_filename
+        assert sorter.keep_original is True
+        assert sorter.backend == 'thread'
+        assert sorter.transfer_mode == 'copy'
+        assert sorter.anonymization_lookup == dict()
+        assert sorter.header_index is None
+
+    def test_options(self):
+        args = cli.create_parser().parse_args([
+            'a', 'b', '-o', 'output', '-d', '%(PatientID)s',
+            '-d', '%(SeriesDescription)s', '-f', '%(InstanceNumber)d.dcm',
+            '-w', '8', '-b', 'process', '-t', 'hardlink', '--move',
+            '--queue-size', '100', '--legacy',
+        ])
+        sorter = cli.create_sorter(args)
+
+        assert sorter.pathname == ['a', 'b']
+        assert sorter.folders == ['%(PatientID)s', '%(SeriesDescription)s']
+        assert sorter.filename == '%(InstanceNumber)d.dcm'
+        assert sorter.workers == 8
+        assert sorter.backend == 'process'
+        assert sorter.transfer_mode == 'hardlink'
+        assert sorter.keep_original is False
+        assert sorter.queue_size == 100
+        assert sorter.read_legacy is True
+
+    def test_in_place(self):
+        args = cli.create_parser().parse_args(
+            ['input', '-o', 'output', '--in-place']
+        )
+
+        assert cli.create_sorter(args).folders is None
+
+    def test_index(self, tmpdir):
+        filename = str(tmpdir.join('index.db'))
+        args = cli.create_parser().parse_args(
+            ['input', '-o', 'output', '--index', filename]
+        )
+
+        assert cli.create_sorter(args).header_index.filename == filename
+
+    def test_anonymization(self, tmpdir):
+        args = cli.create_parser().parse_args([
+            'input', '-o', 'output', '-a', '-c', str(tmpdir.join('missing')),
+            '-r', 'PatientName=Someone', '-p', 'PatientID',
+        ])
+        sorter = cli.create_sorter(args)
+
+        lookup = sorter.anonymization_lookup
+
+        assert lookup['PatientName'] == 'Someone'
+        assert lookup['PatientBirthDate'] == ''
+        assert isinstance(lookup['PatientID'], Pseudonymizer)
+
+
+class TestSummary:
+    def test_summary(self):
+        statistics = SortStatistics('thread', 4, total=10, queue=Queue(8))
+        statistics.add(10, 5000000)
+        statistics.updated = statistics.started + 2
+        statistics.blocked = 0.5
+
+        assert cli.summary(statistics) == (
+            'Processed 10 of 10 files (5.0 MB) in 2.00 s: 5.0 files/s, '
+            '2.5 MB/s [thread backend, 4 workers, queue size 8, discovery '
+            'blocked 0.50 s]'
+        )
+
+
+class TestMain:
+    def test_sort(self, dicom_generator, tmpdir, capsys):
+        tmpdir.mkdir('input')
+
+        for index in range(1, 4):
+            dicom_generator(
+                'input/image{}.dcm'.format(index), InstanceNumber=index,
+                PatientID='123'
+            )
+
+        output = tmpdir.join('output')
+
+        status = cli.main([
+            str(tmpdir.join('input')), '-o', str(output),
+            '-d', '%(PatientID)s', '-f', '%(InstanceNumber)d.dcm',
+            '-r', 'PatientName=ANON', '-w', '2',
+        ])
+
+        assert status == 0
+        assert sorted(os.listdir(str(output.join('123')))) == \
+            ['1.dcm', '2.dcm', '3.dcm']
+
+        dataset = pydicom.read_file(str(output.join('123', '1.dcm')))
+        assert dataset.PatientName == 'ANON'
+
+        stderr = capsys.readouterr().err
+        assert '3 / 3 files' in stderr
+        assert 'Processed 3 of 3 files' in stderr
+
+    def test_quiet(self, dicom_generator, tmpdir, capsys):
+        filename, _ = dicom_generator()
+
+        status = cli.main([
+            os.path.dirname(filename), '-o', str(tmpdir.join('output')), '-q'
+        ])
+
+        assert status == 0
+        assert capsys.readouterr().err == ''
+
+    def test_failures(self, dicom_generator, tmpdir, capsys, mocker):
+        filename, _ = dicom_generator()
+
+        mocker.patch(
+            'dicomsort.dicomsorter.SortJob.sort_image',
+            side_effect=OSError(28, 'No space left on device')
+        )
+
+        status = cli.main([
+            os.path.dirname(filename), '-o', str(tmpdir.join('output')), '-q'
+        ])
+
+        assert status == 1
+        assert capsys.readouterr().err == (
+            'Failed to sort {}: OSError: [Errno 28] No space left on '
+            'device\n'.format(filename)
+        )
+
+    def test_incomplete(self, dicom_generator, tmpdir, mocker):
+        filename, _ = dicom_generator()
+
+        # Nothing is left to sort the discovered file
+        mocker.patch('dicomsort.dicomsorter.Sorter.run')
+
+        status = cli.main([
+            os.path.dirname(filename), '-o', str(tmpdir.join('output')), '-q'
+        ])
+
+        assert status == 1
+
+    def test_missing_path(self, tmpdir, capsys):
+        missing = str(tmpdir.join('missing'))
+
+        with pytest.raises(SystemExit) as excinfo:
+            cli.main([str(tmpdir), missing, '-o', str(tmpdir.join('out'))])
+
+        assert excinfo.value.code != 0
+        assert 'No such directory: {}'.format(missing) in \
+            capsys.readouterr().err
+
+    def test_invalid_queue_size(self, tmpdir, capsys):
+        with pytest.raises(SystemExit):
+            cli.main([str(tmpdir), '-o', 'output', '--queue-size', '0'])
+
+        assert 'Invalid queue size' in capsys.readouterr().err
+
+    def test_invalid_workers(self, tmpdir, capsys):
+        with pytest.raises(SystemExit):
+            cli.main([str(tmpdir), '-o', 'output', '-w', '-1'])
+
+        assert 'Invalid number of workers' in capsys.readouterr().err
+
+    def test_counter_without_store(self, tmpdir, capsys):
+        with pytest.raises(SystemExit):
+            cli.main([
+                str(tmpdir), '-o', 'output', '-p', 'PatientID',
+                '--pseudonym-strategy', 'counter', '-b', 'process',
+            ])
+
+        assert 'require a pseudonym store' in capsys.readouterr().err
+
+
+class TestImport:
+    def test_import_time(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_TIME_SCRIPT], universal_newlines=True
+        )
+        elapsed, modules = output.splitlines()
+        modules = modules.split()
+
+        assert float(elapsed) < IMPORT_BUDGET
+
+        # These are only imported once they are needed
+        assert 'wx' not in modules
+        assert 'pydicom' not in modules
+        assert 'configobj' not in modules
@@ -1,16 +1,65 @@
+import errno
 import os
+import pickle
 import pydicom
 import pytest
+import subprocess
+import sys
+import threading
 import time
 
 from queue import Queue
 
-from dicomsort.dicomsorter import Dicom, DicomSorter, Sorter
+from dicomsort import dicomsorter
+from dicomsort.dicomsorter import (
+    DestinationCache, Dicom, DicomSorter, Discovery, ProcessSorter, SortJob,
+    SortStatistics, Sorter, Tuner, required_fields
+)
+from dicomsort.anonymization import AnonymizationRules
+from dicomsort.headers import HeaderIndex
+from dicomsort.pseudonyms import PseudonymStore, Pseudonymizer
+from dicomsort import utils
 from dicomsort.errors import DicomFolderError
 
 
 def default_sorter():
-    return Sorter(Queue(), '', [], '')
+    return Sorter(Queue(), SortJob('', [], ''))
+
+
+class TestRequiredFields:
+    def test_no_formats(self):
+        assert required_fields([]) == set()
+
+    def test_dicom_fields(self):
+        formats = ['%(PatientName)s', '%(StudyDate)s_%(SeriesNumber)d']
+        expected = {'PatientName', 'StudyDate', 'SeriesNumber'}
+
+        assert required_fields(formats) == expected
+
+    def test_override_fields(self):
+        fields = required_fields(['%(SeriesDescription)s'])
+
+        assert fields == {'SeriesDescription', 'SeriesNumber'}
+
+    def test_anonymization_replacements(self):
+        lookup = {
+            'PatientName': 'ANONYMOUS',
+            'PatientID': '%(PatientName)s %(StudyID)s',
+        }
+
+        fields = required_fields(['%(PatientID)s'], lookup)
+
+        assert fields == {'PatientID', 'PatientName', 'StudyID'}
+
+    def test_anonymization_birth_date(self):
+        fields = required_fields([], {'PatientBirthDate': ''})
+
+        assert fields == {'PatientAge', 'PatientBirthDate', 'StudyDate'}
+
+    def test_anonymization_pseudonym(self):
+        lookup = {'OtherPatientIDs': Pseudonymizer(key='secret')}
+
+        assert required_fields([], lookup) == {'PatientID'}
 
 
 class TestDicom:
@@ -33,6 +82,14 @@ class TestDicom:
         func.assert_not_called()
         assert dcm.dicom == dataset
 
+    def test_constructor_header_only(self, dicom_generator):
+        filename, _ = dicom_generator(BitsAllocated=8, PixelData=b'\0' * 64)
+
+        dcm = Dicom(filename, header_only=True)
+
+        assert dcm.header_only is True
+        assert 'PixelData' not in dcm.dicom
+
     def test_get_item_override_function(self, dicom_generator):
         filename, dicom = dicom_generator()
         dcm = Dicom(filename, dcm=dicom)
@@ -257,6 +314,50 @@ class TestDicom:
         assert dcm.overrides['PatientBirthDate'] == '20180101'
         assert dcm['PatientBirthDate'] == '20180101'
 
+    def test_anonymize_missing_birthdate(self, dicom_generator):
+        filename, dataset = dicom_generator()
+        dcm = Dicom(filename, dcm=dataset)
+
+        dcm.set_anonymization_rules({'PatientBirthDate': ''})
+
+        assert dcm['PatientBirthDate'] == ''
+
+    def test_anonymize_birthdate_shared_rules(self, dicom_generator):
+        rules = AnonymizationRules({'PatientBirthDate': ''})
+
+        filename, dataset = dicom_generator(
+            'first.dcm', PatientBirthDate='20170601', StudyDate='20180201'
+        )
+        first = Dicom(filename, dcm=dataset)
+        first.set_anonymization_rules(rules)
+
+        filename, dataset = dicom_generator(
+            'second.dcm', PatientBirthDate='19800101', StudyDate='20180201'
+        )
+        second = Dicom(filename, dcm=dataset)
+        second.set_anonymization_rules(rules)
+
+        # The value derived for one file doesn't leak into the other
+        assert first['PatientBirthDate'] == '20180101'
+        assert second['PatientBirthDate'] == '19800101'
+        assert rules.lookup['PatientBirthDate'] == ''
+
+    def test_anonymize_pseudonym(self, dicom_generator):
+        filename, dataset = dicom_generator(PatientID='123')
+        dcm = Dicom(filename, dcm=dataset)
+
+        pseudonymizer = Pseudonymizer(key='secret')
+        dcm.set_anonymization_rules({
+            'PatientID': pseudonymizer,
+            'OtherPatientIDs': '%(PatientID)s',
+        })
+
+        assert dcm['PatientID'] == pseudonymizer('123')
+        assert dcm.rules.values(dcm) == {
+            'PatientID': pseudonymizer('123'),
+            'OtherPatientIDs': pseudonymizer('123'),
+        }
+
     def test_get_destination(self, dicom_generator):
         filename, dicom = dicom_generator(
             PatientName='name',
@@ -452,6 +553,29 @@ class TestDicom:
 
         assert newdcm.PatientName == 'ANON'
 
+    def test_sort_anonymize_header_only(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(
+            PatientName='TO^BE^REMOVED',
+            SeriesDescription='desc',
+            SeriesNumber=1,
+            BitsAllocated=8,
+            PixelData=b'\1' * 64,
+        )
+        dcm = Dicom(filename, header_only=True)
+        dcm.set_anonymization_rules({'PatientName': 'ANON'})
+
+        root = str(tmpdir.join('output'))
+
+        dcm.sort(root, ['%(PatientName)s'], '%(ImageType)s')
+
+        destination = os.path.join(root, 'ANON', 'Unknown')
+
+        # The pixel data is read back in when the file is re-written
+        newdcm = pydicom.read_file(destination)
+
+        assert newdcm.PatientName == 'ANON'
+        assert newdcm.PixelData == b'\1' * 64
+
     def test_sort_anonymize_invalid_field(self, dicom_generator, tmpdir):
         filename, dicom = dicom_generator(
             PatientName='TO^BE^REMOVED',
@@ -487,6 +611,124 @@ class TestDicom:
 
         assert 'PatientID' not in newdcm
 
+    def test_sort_registry(self, dicom_generator, tmpdir):
+        registry = utils.DestinationRegistry()
+        root = str(tmpdir.join('output'))
+
+        for index in range(2):
+            filename, dicom = dicom_generator(
+                'image{}.dcm'.format(index),
+                SeriesDescription='desc',
+                SeriesNumber=1,
+            )
+            dcm = Dicom(filename, dcm=dicom)
+
+            dcm.sort(
+                root, ['%(SeriesDescription)s'], '%(ImageType)s',
+                keep_original=False, registry=registry
+            )
+
+        destination = os.path.join(root, 'desc_Series0001', 'Unknown')
+
+        # Files are moved onto the reserved destinations
+        assert pydicom.read_file(destination).SeriesNumber == 1
+        assert pydicom.read_file(destination + '.copy').SeriesNumber == 1
+
+    def test_sort_transfer(self, dicom_generator, tmpdir, mocker):
+        filename, dicom = dicom_generator(SeriesNumber=1)
+        dcm = Dicom(filename, dcm=dicom)
+
+        mover = mocker.Mock()
+        root = str(tmpdir.join('output'))
+
+        dcm.sort(root, ['%(SeriesNumber)s'], '%(ImageType)s', transfer=mover)
+
+        destination = os.path.join(root, '1', 'Unknown')
+        mover.assert_called_once_with(filename, destination)
+
+    def test_sort_transfer_move(self, dicom_generator, tmpdir, mocker):
+        filename, dicom = dicom_generator(SeriesNumber=1)
+        dcm = Dicom(filename, dcm=dicom)
+
+        mover = mocker.Mock()
+        root = str(tmpdir.join('output'))
+
+        dcm.sort(
+            root, ['%(SeriesNumber)s'], '%(ImageType)s', keep_original=False,
+            transfer=mover
+        )
+
+        destination = os.path.join(root, '1', 'Unknown')
+        mover.move.assert_called_once_with(filename, destination)
+        mover.assert_not_called()
+
+    def test_sort_anonymize_temporary_file(self, dicom_generator, tmpdir):
+        filename, dicom = dicom_generator(SeriesNumber=1)
+        dcm = Dicom(filename, dcm=dicom)
+        dcm.set_anonymization_rules({'PatientName': 'ANON'})
+
+        output = tmpdir.join('output')
+
+        dcm.sort(str(output), ['%(SeriesNumber)s'], '%(ImageType)s')
+
+        # Only the final file remains
+        assert output.join('1').listdir() == [output.join('1', 'Unknown')]
+
+    def test_sort_anonymize_write_error(self, dicom_generator, tmpdir,
+                                        mocker):
+        filename, dicom = dicom_generator(SeriesNumber=1)
+        dcm = Dicom(filename, dcm=dicom)
+        dcm.set_anonymization_rules({'PatientName': 'ANON'})
+
+        mocker.patch.object(os, 'replace', side_effect=OSError)
+
+        output = tmpdir.join('output')
+
+        with pytest.raises(OSError):
+            dcm.sort(str(output), ['%(SeriesNumber)s'], '%(ImageType)s')
+
+        # The temporary file was cleaned up and the original is untouched
+        assert output.join('1').listdir() == []
+        assert os.path.exists(filename)
+
+    def test_sort_anonymize_error_registry(self, dicom_generator, tmpdir,
+                                           mocker):
+        filename, dicom = dicom_generator(SeriesNumber=1)
+        dcm = Dicom(filename, dcm=dicom, header_only=True)
+        dcm.set_anonymization_rules({'PatientName': 'ANON'})
+
+        mocker.patch(
+            'dicomsort.dicomsorter.write_anonymized', side_effect=OSError
+        )
+
+        output = tmpdir.join('output')
+
+        with pytest.raises(OSError):
+            dcm.sort(
+                str(output), ['%(SeriesNumber)s'], '%(ImageType)s',
+                registry=utils.DestinationRegistry()
+            )
+
+        # The reserved destination isn't left behind as an empty file
+        assert output.join('1').listdir() == []
+
+    def test_sort_transfer_error_registry(self, dicom_generator, tmpdir,
+                                          mocker):
+        filename, dicom = dicom_generator(SeriesNumber=1)
+        dcm = Dicom(filename, dcm=dicom)
+
+        transfer = mocker.Mock(side_effect=OSError)
+        output = tmpdir.join('output')
+
+        with pytest.raises(OSError):
+            dcm.sort(
+                str(output), ['%(SeriesNumber)s'], '%(ImageType)s',
+                registry=utils.DestinationRegistry(), transfer=transfer
+            )
+
+        assert output.join('1').listdir() == []
+        assert os.path.exists(filename)
+
     def test_sort_test(self, dicom_generator, tmpdir, capsys):
         filename, dicom = dicom_generator(
             SeriesDescription='desc',
@@ -521,6 +763,561 @@ class TestDicom:
         assert captured.out == str(destination) + '\n'
 
 
+class TestDestinationCache:
+    def test_fields(self):
+        cache = DestinationCache(['%(PatientName)s', '%(SeriesDescription)s'])
+
+        assert cache.fields == ['PatientName', 'SeriesDescription']
+
+    def test_key(self, dicom_generator):
+        filename, dataset = dicom_generator(SeriesNumber=3)
+        dcm = Dicom(filename, dcm=dataset)
+
+        cache = DestinationCache(['%(SeriesNumber)s'])
+
+        assert cache.key(dcm) == ('3',)
+
+    def test_fields_templated_replacement(self):
+        lookup = {'PatientID': 'X_%(PatientName)s'}
+
+        cache = DestinationCache(['%(PatientID)-12s'], lookup)
+
+        assert cache.fields == ['PatientID', 'PatientName']
+
+    def test_key_missing_field(self, dicom_generator):
+        filename, dataset = dicom_generator()
+        dcm = Dicom(filename, dcm=dataset)
+
+        cache = DestinationCache(['%(Invalid)s'])
+
+        assert cache.key(dcm) is None
+
+    def test_get_same_series(self, dicom_generator, mocker):
+        spy = mocker.spy(Dicom, 'get_directory')
+
+        directory = ['%(PatientName)s', '%(SeriesDescription)s']
+        cache = DestinationCache(directory)
+
+        destinations = list()
+        for index in range(1, 4):
+            filename, dataset = dicom_generator(
+                'image{}.dcm'.format(index), InstanceNumber=index
+            )
+            dcm = Dicom(filename, dcm=dataset)
+
+            destinations.append(dcm.get_destination(
+                '/root', directory, '%(InstanceNumber)d', cache=cache
+            ))
+
+        expected = '/root/Jonathan^Suever/Dicom Sort Test Series_Series0001'
+
+        assert destinations == [
+            os.path.join(expected, str(index)) for index in range(1, 4)
+        ]
+
+        # The directory is only computed for the first file
+        assert spy.call_count == 1
+
+    def test_get_different_series(self, dicom_generator):
+        directory = ['%(SeriesNumber)s']
+        cache = DestinationCache(directory)
+
+        filename, dataset = dicom_generator('image1.dcm', SeriesNumber=1)
+        first = cache.get(Dicom(filename, dcm=dataset), '/root', directory)
+
+        filename, dataset = dicom_generator('image2.dcm', SeriesNumber=2)
+        second = cache.get(Dicom(filename, dcm=dataset), '/root', directory)
+
+        assert first == '/root/1'
+        assert second == '/root/2'
+        assert len(cache.directories) == 2
+
+    def test_get_templated_replacement(self, dicom_generator, tmpdir):
+        lookup = {'PatientID': 'X_%(PatientName)s'}
+        job = SortJob(str(tmpdir), ['%(PatientID)-12s'], '', lookup)
+
+        directories = list()
+        for index in range(2):
+            filename, dataset = dicom_generator(
+                'image{}.dcm'.format(index),
+                PatientName='Pat^{}'.format(index)
+            )
+            dcm = Dicom(filename, dcm=dataset)
+            dcm.set_anonymization_rules(job.rules)
+
+            directories.append(job.destinations.get(
+                dcm, '/root', job.directory_format
+            ))
+
+        # Patients aren't merged although the template of the replacement
+        # is the same for both of them
+        assert directories == ['/root/X_Pat^0', '/root/X_Pat^1']
+
+    def test_get_missing_field(self, dicom_generator):
+        cache = DestinationCache(['%(Invalid)s'])
+
+        filename, dataset = dicom_generator()
+        dcm = Dicom(filename, dcm=dataset)
+
+        assert cache.get(dcm, '/root', ['%(Invalid)s']) == '/root/UNKNOWN'
+        assert cache.directories == dict()
+
+    def test_get_maxsize(self, dicom_generator):
+        directory = ['%(SeriesNumber)s']
+        cache = DestinationCache(directory, maxsize=1)
+
+        for index in range(1, 3):
+            filename, dataset = dicom_generator(
+                'image{}.dcm'.format(index), SeriesNumber=index
+            )
+            cache.get(Dicom(filename, dcm=dataset), '/root', directory)
+
+        assert list(cache.directories.values()) == ['/root/2']
+
+
+class TestSortJob:
+    def test_compiled_formats(self):
+        lookup = {'PatientID': '%(PatientName)s'}
+
+        job = SortJob('', ['%(PatientID)s'], '%(ImageType)s', lookup)
+
+        assert job.directory_format[0].template == '%(PatientName)s'
+        assert job.filename_format.fields == {'ImageType'}
+
+    def test_compiled_anonymization_rules(self, dicom_generator, mocker):
+        filename, _ = dicom_generator()
+        lookup = {'PatientName': 'ANON'}
+
+        job = SortJob('', [], '', lookup, test=True)
+
+        func = mocker.patch.object(Dicom, 'set_anonymization_rules')
+        job.sort_image(filename)
+
+        assert job.rules.lookup == lookup
+        func.assert_called_once_with(job.rules)
+
+    def test_pickle(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(PatientID='123', SeriesNumber=1)
+
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+        lookup = {
+            'PatientName': 'ANON',
+            'PatientID': Pseudonymizer('PatientID', store=store),
+            'StudyDescription': '%(PatientName)s',
+            'PatientBirthDate': '',
+        }
+
+        job = SortJob(
+            str(tmpdir.join('output')), ['%(PatientID)s'], '%(ImageType)s',
+            lookup, tags=['PatientID', 'PatientName', 'SeriesNumber'],
+            transfer_mode='hardlink',
+            index=HeaderIndex(str(tmpdir.join('index.db')))
+        )
+
+        # Worker processes receive the job like this
+        restored = pickle.loads(pickle.dumps(job))
+
+        assert restored.rules.lookup.keys() == job.rules.lookup.keys()
+        assert restored.tags == job.tags
+        assert restored.index.filename == job.index.filename
+
+        restored.sort_image(filename)
+
+        pseudonym = lookup['PatientID']('123')
+        output = tmpdir.join('output', pseudonym, 'Unknown')
+        dataset = pydicom.read_file(str(output))
+
+        assert dataset.PatientName == 'ANON'
+        assert dataset.PatientID == pseudonym
+
+    def test_compiled_formats_in_place(self):
+        job = SortJob('', None, '%(ImageType)s')
+
+        assert job.directory_format is None
+
+    def test_sort_image_invalid_dicom(self, tmpdir):
+        fobj = tmpdir.join('invalid')
+        fobj.write('invalid')
+
+        output = tmpdir.join('output')
+
+        job = SortJob(str(output), ['%(SeriesDescription)s'], '')
+        job.sort_image(str(fobj))
+
+        assert os.path.exists(str(output)) is False
+
+    def test_sort_image_keep_filename(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator('original.dcm', SeriesNumber=1)
+
+        output = tmpdir.join('output')
+
+        job = SortJob(
+            str(output), ['%(SeriesNumber)s'], '%(ImageType)s',
+            keep_filename=True
+        )
+        job.sort_image(filename)
+
+        assert os.path.exists(str(output.join('1').join('original.dcm')))
+
+    def test_sort_image_legacy(self, dicom_generator, strip_preamble,
+                               tmpdir):
+        filename, _ = dicom_generator('legacy.dcm', SeriesNumber=1)
+        strip_preamble(filename)
+
+        output = tmpdir.join('output')
+
+        job = SortJob(str(output), ['%(SeriesNumber)s'], '%(ImageType)s')
+        job.sort_image(filename)
+
+        assert os.path.exists(str(output)) is False
+
+        job.legacy = True
+        job.sort_image(filename)
+
+        assert os.path.exists(str(output.join('1').join('Unknown')))
+
+    def test_sort_image_index(self, dicom_generator, tmpdir, mocker):
+        filename, _ = dicom_generator('image.dcm', SeriesNumber=1)
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        output = tmpdir.join('output')
+
+        job = SortJob(
+            str(output), ['%(SeriesNumber)s'], '%(ImageType)s',
+            tags=['SeriesNumber'], index=index
+        )
+
+        assert job.sort_image(filename) == os.path.getsize(filename)
+
+        isdicom = mocker.patch.object(utils, 'isdicom')
+
+        assert job.sort_image(filename) == os.path.getsize(filename)
+        isdicom.assert_not_called()
+
+        images = sorted(os.listdir(str(output.join('1'))))
+        assert images == ['Unknown', 'Unknown.copy']
+
+
+class TestSortStatistics:
+    def test_constructor(self):
+        statistics = SortStatistics('thread', 2, total=10)
+
+        assert statistics.backend == 'thread'
+        assert statistics.workers == 2
+        assert statistics.total == 10
+        assert statistics.processed == 0
+        assert statistics.throughput() == 0.0
+
+    def test_add(self):
+        statistics = SortStatistics('thread', 2)
+        statistics.started -= 2
+
+        statistics.add(1, 100)
+        statistics.add(3, 200)
+
+        assert statistics.processed == 4
+        assert statistics.bytes == 300
+        assert statistics.throughput() == pytest.approx(2, rel=0.05)
+
+    def test_queue_depth(self):
+        queue = Queue(5)
+        queue.put('a')
+        queue.put('b')
+
+        statistics = SortStatistics('thread', 2, queue=queue)
+
+        assert statistics.queue_depth() == 2
+        assert statistics.queue_size() == 5
+
+    def test_queue_depth_without_queue(self):
+        statistics = SortStatistics('thread', 2)
+
+        assert statistics.queue_depth() == 0
+        assert statistics.queue_size() == 0
+
+
+class TestDiscovery:
+    def test_backpressure(self, tmpdir):
+        for name in 'abc':
+            tmpdir.join(name).write('')
+
+        queue = Queue(1)
+        statistics = SortStatistics('thread', 0, queue=queue)
+
+        discovery = Discovery(queue, [str(tmpdir)], statistics)
+        discovery.start()
+
+        time.sleep(0.2)
+
+        # Discovery waits until there is room in the queue
+        assert queue.qsize() == 1
+        assert discovery.finished is False
+
+        files = list()
+        while len(files) < 3:
+            files.append(queue.get(timeout=1))
+
+        discovery.join()
+
+        assert discovery.finished is True
+        assert statistics.total == 3
+        assert statistics.blocked > 0
+
+    def test_run(self, tmpdir):
+        tmpdir.join('a').write('')
+        tmpdir.mkdir('nested').join('b').write('')
+
+        queue = Queue()
+        statistics = SortStatistics('thread', 0)
+        spawned = list()
+
+        discovery = Discovery(
+            queue, [str(tmpdir)], statistics,
+            spawn=lambda: spawned.append(True), workers=1
+        )
+        discovery.start()
+        discovery.join()
+
+        files = sorted(queue.get_nowait() for _ in range(queue.qsize()))
+        expected = [str(tmpdir.join('a')), str(tmpdir.join('nested', 'b'))]
+
+        assert files == expected
+        assert discovery.finished is True
+        assert statistics.total == 2
+
+        # Never starts more workers than requested
+        assert spawned == [True]
+        assert statistics.workers == 1
+
+    def test_no_workers_alive(self, tmpdir, mocker):
+        for name in 'abcd':
+            tmpdir.join(name).write('')
+
+        queue = Queue(1)
+        statistics = SortStatistics('thread', 0, queue=queue)
+
+        # The only worker died without emptying the queue
+        worker = mocker.Mock(spec=Sorter)
+        worker.is_alive.return_value = False
+
+        discovery = Discovery(
+            queue, [str(tmpdir)], statistics, spawn=mocker.Mock(),
+            workers=1, sorters=[worker]
+        )
+        discovery.start()
+        discovery.join(timeout=5)
+
+        assert discovery.finished is True
+        assert statistics.total == 1
+
+    def test_run_no_files(self, tmpdir):
+        statistics = SortStatistics('thread', 0)
+        spawned = list()
+
+        discovery = Discovery(
+            Queue(), [str(tmpdir)], statistics,
+            spawn=lambda: spawned.append(True), workers=2
+        )
+        discovery.start()
+        discovery.join()
+
+        assert discovery.finished is True
+        assert statistics.total == 0
+        assert spawned == []
+
+
+class TestSorter:
+    def test_next_file_waits_for_discovery(self, mocker):
+        mocker.patch.object(Sorter, 'start')
+
+        queue = Queue()
+        discovery = mocker.Mock(finished=False)
+
+        sorter = Sorter(queue, SortJob('', [], ''), discovery=discovery)
+
+        def discover():
+            queue.put('file')
+            discovery.finished = True
+
+        # Discovery finds a file while the sorter is already waiting
+        timer = threading.Timer(0.3, discover)
+        timer.start()
+
+        assert sorter.next_file() == 'file'
+        assert sorter.next_file() is None
+
+    def test_next_file_without_discovery(self, tmpdir):
+        fobj = tmpdir.join('invalid')
+        fobj.write('invalid')
+
+        queue = Queue()
+        queue.put(str(fobj))
+
+        sorter = Sorter(queue, SortJob('', [], ''))
+        sorter.join()
+
+        assert queue.qsize() == 0
+
+    def test_stop(self, mocker):
+        mocker.patch.object(Sorter, 'start')
+
+        queue = Queue()
+        queue.put('file')
+
+        sorter = default_sorter()
+        sorter.queue = queue
+        sorter.stop()
+        sorter.run()
+
+        assert sorter.stopped is True
+        assert queue.qsize() == 1
+
+    def test_run_failure(self, mocker):
+        mocker.patch.object(Sorter, 'start')
+
+        queue = Queue()
+        queue.put('bad')
+        queue.put('good')
+
+        statistics = SortStatistics('thread', 1, total=2)
+        sorter = Sorter(queue, SortJob('', [], ''), statistics=statistics)
+
+        def sort_image(filename):
+            if filename == 'bad':
+                raise OSError(errno.ENOSPC, 'No space left on device')
+
+            return 10
+
+        mocker.patch.object(sorter, 'sort_image', side_effect=sort_image)
+        sorter.run()
+
+        # The remaining files are still sorted
+        expected = [('bad', 'OSError: [Errno 28] No space left on device')]
+
+        assert sorter.failures == expected
+        assert statistics.failures == expected
+        assert statistics.processed == 1
+        assert statistics.completed() == 2
+
+    def test_run_error_finishes_counter(self, mocker):
+        mocker.patch.object(Sorter, 'start')
+
+        sorter = default_sorter()
+        mocker.patch.object(sorter, 'next_file', side_effect=RuntimeError)
+        finish_counter = mocker.patch.object(sorter, 'finish_counter')
+
+        with pytest.raises(RuntimeError):
+            sorter.run()
+
+        finish_counter.assert_called_once_with()
+
+
+class TestTuner:
+    def tuner(self, mocker, sorters, maximum=4):
+        mocker.patch.object(Tuner, 'start')
+
+        def spawn():
+            sorter = mocker.Mock(spec=Sorter, stopped=False)
+            sorter.is_alive.return_value = True
+            sorters.append(sorter)
+            return sorter
+
+        for _ in range(2):
+            spawn()
+
+        statistics = SortStatistics('thread', len(sorters))
+
+        return Tuner(spawn, sorters, statistics, maximum=maximum)
+
+    def test_grow(self, mocker):
+        sorters = list()
+        tuner = self.tuner(mocker, sorters)
+
+        tuner.adjust(1)
+
+        assert len(tuner.active()) == 3
+        assert tuner.statistics.workers == 3
+
+    def test_grow_maximum(self, mocker):
+        sorters = list()
+        tuner = self.tuner(mocker, sorters, maximum=2)
+
+        tuner.adjust(1)
+
+        assert len(tuner.active()) == 2
+        assert tuner.statistics.workers == 2
+
+    def test_shrink(self, mocker):
+        sorters = list()
+        tuner = self.tuner(mocker, sorters)
+
+        tuner.adjust(-1)
+
+        sorters[-1].stop.assert_called_once_with()
+        assert tuner.statistics.workers == 1
+
+    def test_shrink_minimum(self, mocker):
+        sorters = list()
+        tuner = self.tuner(mocker, sorters)
+        sorters.pop()
+
+        tuner.adjust(-1)
+
+        sorters[0].stop.assert_not_called()
+
+
+class TestProcessSorter:
+    def test_chunks(self, mocker):
+        mocker.patch.object(ProcessSorter, 'start')
+
+        queue = Queue()
+        for index in range(5):
+            queue.put(str(index))
+
+        sorter = ProcessSorter(queue, SortJob('', [], ''), chunk_size=2)
+
+        chunks = list(sorter.chunks())
+
+        assert chunks == [['0', '1'], ['2', '3'], ['4']]
+
+    def test_chunks_stopped(self, mocker):
+        mocker.patch.object(ProcessSorter, 'start')
+
+        queue = Queue()
+        for index in range(5):
+            queue.put(str(index))
+
+        sorter = ProcessSorter(queue, SortJob('', [], ''), chunk_size=2)
+        chunks = sorter.chunks()
+
+        assert next(chunks) == ['0', '1']
+
+        sorter.stop()
+
+        # No more files are dispatched once the sorter is stopped
+        assert list(chunks) == []
+        assert queue.qsize() == 3
+
+    def test_sort_chunk_failures(self, mocker):
+        job = mocker.Mock()
+        job.sort_image.side_effect = [10, ValueError('invalid'), 20]
+
+        mocker.patch.object(dicomsorter, '_process_job', job)
+
+        sizes, failures = dicomsorter._sort_chunk(['a', 'b', 'c'])
+
+        assert sizes == [10, 20]
+        assert failures == [('b', 'ValueError: invalid')]
+
+    def test_default_processes(self, mocker):
+        mocker.patch.object(ProcessSorter, 'start')
+        mocker.patch.object(os, 'cpu_count', return_value=12)
+
+        sorter = ProcessSorter(Queue(), SortJob('', [], ''))
+
+        assert sorter.processes == 12
+
+
 class TestDicomSorter:
     def test_constructor_defaults(self):
         sorter = DicomSorter()
@@ -535,6 +1332,11 @@ class TestDicomSorter:
         assert sorter.sorters == []
         assert sorter.folders == []
         assert sorter.anonymization_lookup == dict()
+        assert sorter.read_legacy is False
+        assert sorter.transfer_mode == 'copy'
+        assert sorter.backend == 'thread'
+        assert sorter.workers is None
+        assert sorter.adaptive is False
 
     def test_constructor_single_path(self):
         path = '/path'
@@ -569,6 +1371,63 @@ class TestDicomSorter:
 
         assert sorter.available_fields() == expected
 
+    def test_get_available_fields_index(self, dicom_generator, tmpdir,
+                                        mocker):
+        tmpdir.mkdir('input')
+        filename, dicom = dicom_generator('input/image.dcm')
+
+        sorter = DicomSorter(os.path.dirname(filename))
+        sorter.header_index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        assert sorter.available_fields() == dicom.dir('')
+
+        isdicom = mocker.patch.object(utils, 'isdicom')
+
+        assert sorter.available_fields() == dicom.dir('')
+        isdicom.assert_not_called()
+
+    def test_required_tags(self):
+        sorter = DicomSorter()
+        sorter.folders = ['%(PatientName)s', '%(SeriesDescription)s']
+        sorter.filename = '%(InstanceNumber)04d%(FileExtension)s'
+
+        expected = [
+            'InstanceNumber',
+            'PatientName',
+            'SeriesDescription',
+            'SeriesNumber',
+            'SpecificCharacterSet',
+        ]
+
+        assert sorter.required_tags() == expected
+
+    def test_required_tags_keep_filename(self):
+        sorter = DicomSorter()
+        sorter.folders = ['%(PatientName)s']
+        sorter.keep_filename = True
+
+        expected = ['PatientName', 'SpecificCharacterSet']
+
+        assert sorter.required_tags() == expected
+
+    def test_required_tags_in_place(self):
+        sorter = DicomSorter()
+        sorter.folders = None
+
+        assert sorter.required_tags() == ['SpecificCharacterSet']
+
+    def test_worker_count(self, mocker):
+        mocker.patch.object(os, 'cpu_count', return_value=12)
+
+        sorter = DicomSorter()
+        assert sorter.worker_count() == 2
+
+        sorter.backend = 'process'
+        assert sorter.worker_count() == 12
+
+        sorter.workers = 5
+        assert sorter.worker_count() == 5
+
     def test_is_sorting_no_sorters(self):
         sorter = DicomSorter()
 
@@ -653,7 +1512,7 @@ class TestDicomSorter:
 
         output = tmpdir.join('output')
 
-        sorter.sort(str(output))
+        statistics = sorter.sort(str(output))
 
         # Wait for sorting to complete
         while sorter.is_sorting():
@@ -661,6 +1520,10 @@ class TestDicomSorter:
 
         assert len(sorter.sorters) == 1
 
+        assert statistics is sorter.statistics
+        assert statistics.workers == 1
+        assert statistics.processed == 1
+
         series_folders = output.listdir()
         assert len(series_folders) == 1
 
@@ -670,3 +1533,381 @@ class TestDicomSorter:
         images = series_folder.listdir()
         assert len(images) == 1
         assert os.path.basename(str(images[0])) == 'Unknown (0001).dcm'
+
+    def test_sort_process_backend(self, dicom_generator, tmpdir):
+        for index in range(1, 4):
+            dicom_generator(
+                'image{}.dcm'.format(index),
+                SeriesDescription='desc',
+                SeriesNumber=1,
+                InstanceNumber=index
+            )
+
+        sorter = DicomSorter(str(tmpdir))
+        sorter.folders = ['%(SeriesDescription)s']
+        sorter.backend = 'process'
+        sorter.workers = 3
+
+        output = tmpdir.join('output')
+
+        statistics = sorter.sort(str(output))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        assert len(sorter.sorters) == 1
+        assert isinstance(sorter.sorters[0], ProcessSorter)
+        assert sorter.sorters[0].processes == 3
+
+        # The processes are reported rather than the dispatching thread
+        assert statistics.workers == 3
+
+        images = sorted(os.listdir(str(output.join('desc_Series0001'))))
+        expected = ['Unknown (0001).dcm', 'Unknown (0002).dcm',
+                    'Unknown (0003).dcm']
+
+        assert images == expected
+
+    def test_sort_process_backend_progress(self, dicom_generator, tmpdir):
+        dicom_generator('image1.dcm', InstanceNumber=1)
+        dicom_generator('image2.dcm', InstanceNumber=2)
+
+        reports = list()
+
+        sorter = DicomSorter(str(tmpdir))
+        sorter.backend = 'process'
+        sorter.sort(str(tmpdir.join('output')), listener=reports.append)
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        # Both files of the chunk are counted at once
+        assert reports[-1].count == 2
+        assert reports[-1].total == 2
+        assert reports[-1].finished is True
+
+    def test_sort_anonymize_concurrent(self, dicom_generator, tmpdir):
+        tmpdir.mkdir('input')
+        expected = dict()
+
+        for index in range(256):
+            uid = '1.2.3.{}'.format(index)
+
+            # Files without a birth date must never receive one derived from
+            # another file
+            if index % 2:
+                birth_date = '{}0601'.format(1900 + index)
+                expected[uid] = '{}0101'.format(1901 + index)
+            else:
+                birth_date = expected[uid] = ''
+
+            dicom_generator(
+                'input/image{}.dcm'.format(index), SOPInstanceUID=uid,
+                PatientBirthDate=birth_date, StudyDate='20200101'
+            )
+
+        sorter = DicomSorter(str(tmpdir.join('input')))
+        sorter.folders = []
+        sorter.filename = '%(SOPInstanceUID)s.dcm'
+        sorter.workers = 32
+        sorter.set_anonymization_rules({'PatientBirthDate': ''})
+
+        output = tmpdir.join('output')
+        statistics = sorter.sort(str(output))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        assert statistics.processed == 256
+        assert sorter.anonymization_lookup == {'PatientBirthDate': ''}
+
+        for uid, birth_date in expected.items():
+            dataset = pydicom.read_file(str(output.join(uid + '.dcm')))
+            assert dataset.PatientBirthDate == birth_date
+
+    def test_sort_pseudonyms_process_backend(self, dicom_generator, tmpdir):
+        tmpdir.mkdir('input')
+
+        for index in range(6):
+            dicom_generator(
+                'input/image{}.dcm'.format(index),
+                SOPInstanceUID='1.2.3.{}'.format(index),
+                PatientID='patient{}'.format(index % 2)
+            )
+
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+
+        sorter = DicomSorter(str(tmpdir.join('input')))
+        sorter.folders = ['%(PatientID)s']
+        sorter.filename = '%(SOPInstanceUID)s.dcm'
+        sorter.backend = 'process'
+        sorter.workers = 3
+        sorter.set_anonymization_rules({
+            'PatientID': Pseudonymizer(strategy='counter', store=store),
+        })
+
+        output = tmpdir.join('output')
+        sorter.sort(str(output))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        # All processes agree on the pseudonym of each patient
+        assert sorted(os.listdir(str(output))) == ['000001', '000002']
+
+        for index in range(6):
+            patient = 'patient{}'.format(index % 2)
+            pseudonym = store.get('PatientID', patient)
+            path = output.join(pseudonym).join('1.2.3.{}.dcm'.format(index))
+
+            assert pydicom.read_file(str(path)).PatientID == pseudonym
+
+    def test_sort_queue_size(self, dicom_generator, tmpdir):
+        for index in range(1, 6):
+            dicom_generator('image{}.dcm'.format(index), InstanceNumber=index)
+
+        sorter = DicomSorter(str(tmpdir))
+        sorter.queue_size = 2
+
+        output = tmpdir.join('output')
+        statistics = sorter.sort(str(output))
+
+        assert sorter.queue.maxsize == 2
+        assert statistics.queue_size() == 2
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        assert statistics.processed == 5
+        assert statistics.queue_depth() == 0
+
+    def test_sort_invalid_queue_size(self, tmpdir):
+        sorter = DicomSorter(str(tmpdir))
+        sorter.queue_size = 0
+
+        with pytest.raises(ValueError):
+            sorter.sort(str(tmpdir.join('output')))
+
+    def test_sort_progress_callback(self, dicom_generator, tmpdir):
+        tmpdir.mkdir('input')
+
+        for index in range(1, 6):
+            filename, _ = dicom_generator(
+                'input/image{}.dcm'.format(index), InstanceNumber=index
+            )
+
+        reports = list()
+
+        sorter = DicomSorter(str(tmpdir.join('input')))
+        sorter.progress_rate = 0.001
+        statistics = sorter.sort(
+            str(tmpdir.join('output')), listener=reports.append
+        )
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        # Workers merge their counts in batches and the final count is
+        # reported exactly once
+        counts = [p.count for p in reports]
+        assert counts == sorted(set(counts))
+        assert counts[-1] == 5
+        assert [p.finished for p in reports].count(True) == 1
+        assert reports[-1].finished is True
+        assert reports[-1].size == 5 * os.path.getsize(filename)
+        assert statistics.bytes == reports[-1].size
+
+    def test_sort_invalid_listener(self, tmpdir):
+        sorter = DicomSorter(str(tmpdir))
+
+        with pytest.raises(TypeError):
+            sorter.sort(str(tmpdir.join('output')), listener='listener')
+
+    def test_import_without_wx(self):
+        code = 'import sys, dicomsort.dicomsorter; print("wx" in sys.modules)'
+        output = subprocess.check_output([sys.executable, '-c', code])
+
+        assert output.strip() == b'False'
+
+    def test_sort_invalid_backend(self, tmpdir):
+        sorter = DicomSorter(str(tmpdir))
+        sorter.backend = 'invalid'
+
+        with pytest.raises(ValueError):
+            sorter.sort(str(tmpdir.join('output')))
+
+    @pytest.mark.parametrize('workers', [0, -1])
+    def test_sort_invalid_workers(self, tmpdir, workers):
+        sorter = DicomSorter(str(tmpdir))
+        sorter.workers = workers
+
+        with pytest.raises(ValueError):
+            sorter.sort(str(tmpdir.join('output')))
+
+    def test_sort_counter_process_backend(self, tmpdir):
+        sorter = DicomSorter(str(tmpdir))
+        sorter.backend = 'process'
+        sorter.set_anonymization_rules({
+            'PatientID': Pseudonymizer('PatientID', strategy='counter')
+        })
+
+        # Every process would number the patients on its own
+        with pytest.raises(ValueError):
+            sorter.sort(str(tmpdir.join('output')))
+
+        sorter.backend = 'thread'
+        sorter.sort(str(tmpdir.join('output')))
+
+    def test_sort_workers(self, dicom_generator, tmpdir):
+        for index in range(1, 6):
+            dicom_generator('image{}.dcm'.format(index), InstanceNumber=index)
+
+        sorter = DicomSorter(str(tmpdir))
+        sorter.workers = 4
+
+        output = tmpdir.join('output')
+        statistics = sorter.sort(str(output))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        assert len(sorter.sorters) == 4
+        assert statistics.workers == 4
+        assert statistics.processed == 5
+        assert len(os.listdir(str(output))) == 5
+
+    def test_sort_adaptive(self, dicom_generator, tmpdir):
+        for index in range(1, 6):
+            dicom_generator('image{}.dcm'.format(index), InstanceNumber=index)
+
+        sorter = DicomSorter(str(tmpdir))
+        sorter.adaptive = True
+
+        output = tmpdir.join('output')
+        statistics = sorter.sort(str(output))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        assert any(isinstance(s, Tuner) for s in sorter.sorters)
+        assert statistics.processed == 5
+        assert len(os.listdir(str(output))) == 5
+
+    def test_sort_no_files(self, tmpdir):
+        sorter = DicomSorter(str(tmpdir))
+
+        statistics = sorter.sort(str(tmpdir.join('output')))
+
+        assert sorter.sorters == []
+        assert statistics.total == 0
+        assert statistics.workers == 0
+
+    def test_sort_hardlink(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(SeriesNumber=1, InstanceNumber=1)
+
+        sorter = DicomSorter(str(tmpdir))
+        sorter.folders = ['%(SeriesNumber)s']
+        sorter.transfer_mode = 'hardlink'
+
+        output = tmpdir.join('output')
+        sorter.sort(str(output))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        destination = str(output.join('1').join('Unknown (0001).dcm'))
+
+        assert os.path.samefile(filename, destination)
+
+    def test_sort_index(self, dicom_generator, tmpdir, mocker):
+        tmpdir.mkdir('input')
+
+        for index in range(1, 4):
+            dicom_generator(
+                'input/image{}.dcm'.format(index), PatientID='123',
+                SeriesDescription='desc', SeriesNumber=1,
+                InstanceNumber=index
+            )
+
+        sorter = DicomSorter(str(tmpdir.join('input')))
+        sorter.header_index = HeaderIndex(str(tmpdir.join('index.db')))
+        sorter.folders = ['%(SeriesDescription)s']
+
+        sorter.sort(str(tmpdir.join('first')))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        read_header = mocker.spy(utils, 'read_header')
+
+        # The same files are sorted again using the indexed headers
+        sorter.sort(str(tmpdir.join('second')))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        read_header.assert_not_called()
+
+        second = tmpdir.join('second', 'desc_Series0001')
+        images = sorted(os.listdir(str(second)))
+        assert images == sorted(
+            os.listdir(str(tmpdir.join('first', 'desc_Series0001')))
+        )
+
+        # Fields that weren't indexed yet are read from the files
+        sorter.folders = ['%(PatientID)s']
+        sorter.sort(str(tmpdir.join('third')))
+
+        while sorter.is_sorting():
+            time.sleep(0.1)
+
+        assert read_header.call_count == 3
+        assert len(os.listdir(str(tmpdir.join('third', '123')))) == 3
+
+    def test_sort_failures(self, dicom_generator, tmpdir, mocker):
+        tmpdir.mkdir('input')
+
+        for index in range(10):
+            dicom_generator('input/image{}.dcm'.format(index))
+
+        error = OSError(errno.ENOSPC, 'No space left on device')
+        mocker.patch.object(SortJob, 'sort_image', side_effect=error)
+
+        sorter = DicomSorter(str(tmpdir.join('input')))
+        sorter.queue_size = 2
+
+        statistics = sorter.sort(str(tmpdir.join('output')))
+
+        deadline = time.time() + 10
+        while sorter.is_sorting() and time.time() < deadline:
+            time.sleep(0.1)
+
+        # Every file failed but the sort still completes
+        assert sorter.is_sorting() is False
+        assert statistics.processed == 0
+        assert len(statistics.failures) == 10
+        assert statistics.completed() == statistics.total == 10
+
+    @pytest.mark.filterwarnings(
+        'ignore::pytest.PytestUnhandledThreadExceptionWarning'
+    )
+    def test_sort_workers_died(self, dicom_generator, tmpdir, mocker):
+        tmpdir.mkdir('input')
+
+        for index in range(10):
+            dicom_generator('input/image{}.dcm'.format(index))
+
+        mocker.patch.object(Sorter, 'next_file', side_effect=RuntimeError)
+
+        sorter = DicomSorter(str(tmpdir.join('input')))
+        sorter.queue_size = 2
+
+        statistics = sorter.sort(str(tmpdir.join('output')))
+
+        deadline = time.time() + 10
+        while sorter.is_sorting() and time.time() < deadline:
+            time.sleep(0.1)
+
+        # Discovery gives up once no worker is left to empty the queue
+        assert sorter.is_sorting() is False
+        assert statistics.total < 10
@@ -0,0 +1,156 @@
+import os
+import pickle
+
+from dicomsort import utils
+from dicomsort.dicomsorter import Dicom
+from dicomsort.headers import HeaderIndex, IndexEntry, file_status
+
+
+class TestIndexEntry:
+    def test_covers(self):
+        entry = IndexEntry(['PatientName', 'SeriesNumber'], '{}')
+
+        assert entry.covers(['PatientName'])
+        assert not entry.covers(['PatientName', 'StudyDate'])
+        assert not entry.covers(None)
+
+    def test_covers_entire_header(self):
+        entry = IndexEntry(None, '{}')
+
+        assert entry.covers(['PatientName'])
+        assert entry.covers(None)
+
+    def test_merge_tags(self):
+        entry = IndexEntry(['SeriesNumber'], '{}')
+
+        assert entry.merge_tags(['PatientName']) == \
+            ['PatientName', 'SeriesNumber']
+        assert entry.merge_tags(None) is None
+
+
+class TestHeaderIndex:
+    def test_read(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(SeriesNumber=3)
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        dataset = index.read(filename, ['PatientName', 'SeriesNumber'])
+
+        assert dataset.PatientName == 'Jonathan^Suever'
+        assert index.get(filename, file_status(filename)) is not None
+
+    def test_read_indexed(self, dicom_generator, tmpdir, mocker):
+        filename, _ = dicom_generator(SeriesNumber=3)
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+        tags = ['PatientName', 'SeriesNumber']
+
+        index.read(filename, tags)
+
+        isdicom = mocker.patch.object(utils, 'isdicom')
+        dataset = index.read(filename, tags)
+
+        isdicom.assert_not_called()
+        assert dataset.PatientName == 'Jonathan^Suever'
+        assert dataset.SeriesNumber == 3
+        assert dataset.filename == filename
+
+    def test_exact_values(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(
+            SliceThickness='1.50', EchoTime='2.460', AcquisitionNumber='007'
+        )
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        tags = ['AcquisitionNumber', 'EchoTime', 'SliceThickness']
+        template = utils.compile_format(
+            '%(SliceThickness)s_%(EchoTime)s_%(AcquisitionNumber)s'
+        )
+
+        def render():
+            dataset = index.read(filename, tags)
+            return template.render(Dicom(filename, dataset))
+
+        # Files are rendered the same whether or not they were indexed
+        assert render() == '1.50_2.460_007'
+        assert index.get(filename, file_status(filename)) is not None
+        assert render() == '1.50_2.460_007'
+
+    def test_read_additional_tags(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(SeriesNumber=3)
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        index.read(filename, ['PatientName'])
+        dataset = index.read(filename, ['SeriesNumber'])
+
+        assert dataset.SeriesNumber == 3
+
+        # Both sets of tags are indexed now
+        entry = index.get(filename, file_status(filename))
+        assert entry.covers(['PatientName', 'SeriesNumber'])
+
+    def test_modified_file(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator(SeriesNumber=3)
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        index.read(filename, ['SeriesNumber'])
+
+        dicom_generator(SeriesNumber=4)
+
+        # Make sure the modification time differs on coarse file systems
+        status = os.stat(filename)
+        os.utime(filename, ns=(status.st_atime_ns, status.st_mtime_ns + 1))
+
+        assert index.read(filename, ['SeriesNumber']).SeriesNumber == 4
+
+    def test_stale_status(self, dicom_generator, tmpdir):
+        filename, _ = dicom_generator()
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        index.read(filename, ['PatientName'])
+
+        size, mtime_ns, inode = file_status(filename)
+
+        assert index.get(filename, (size + 1, mtime_ns, inode)) is None
+        assert index.get(filename, (size, mtime_ns + 1, inode)) is None
+        assert index.get(filename, (size, mtime_ns, inode + 1)) is None
+
+    def test_not_dicom(self, tmpdir):
+        fobj = tmpdir.join('invalid')
+        fobj.write('invalid')
+
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        assert index.read(str(fobj)) is False
+        assert index.get(str(fobj), file_status(str(fobj))) is None
+
+    def test_legacy(self, dicom_generator, strip_preamble, tmpdir):
+        filename, _ = dicom_generator(SeriesNumber=3)
+        strip_preamble(filename)
+
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        assert index.read(filename, ['SeriesNumber'], legacy=True)
+
+        # Indexed legacy files are still skipped unless legacy is requested
+        assert index.read(filename, ['SeriesNumber']) is False
+
+    def test_entire_header(self, dicom_generator, tmpdir):
+        filename, dicom = dicom_generator()
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+
+        index.read(filename)
+
+        assert index.read(filename).dir('') == dicom.dir('')
+
+    def test_pickle(self, tmpdir):
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+        index.connection()
+
+        restored = pickle.loads(pickle.dumps(index))
+
+        assert restored.filename == index.filename
+
+    def test_close(self, tmpdir):
+        index = HeaderIndex(str(tmpdir.join('index.db')))
+        index.connection()
+        index.close()
+
+        assert index.local.connection is None
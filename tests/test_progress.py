@@ -0,0 +1,211 @@
+import pytest
+import threading
+
+from queue import Queue
+
+from dicomsort.dicomsorter import SortStatistics
+from dicomsort.progress import Progress, ProgressCounter, ProgressReporter
+
+
+class FakeDiscovery:
+    def __init__(self, finished=True):
+        self.finished = finished
+
+
+class TestProgress:
+    def test_throughput(self):
+        progress = Progress(10, 40, size=5000, elapsed=2.0)
+
+        assert progress.throughput() == 5.0
+        assert progress.bytes_per_second() == 2500.0
+
+    def test_no_elapsed_time(self):
+        progress = Progress(0, 40)
+
+        assert progress.throughput() == 0.0
+        assert progress.bytes_per_second() == 0.0
+        assert progress.eta() is None
+
+    def test_eta(self):
+        progress = Progress(10, 40, elapsed=2.0)
+
+        assert progress.eta() == pytest.approx(6.0)
+
+    def test_eta_finished(self):
+        progress = Progress(40, 40, elapsed=2.0, finished=True)
+
+        assert progress.eta() == 0.0
+
+    def test_str(self):
+        progress = Progress(10, 40, size=3500000, elapsed=2.0)
+
+        assert str(progress) == \
+            '10 / 40 files, 3.5 MB, 5.0 files/s, ETA 0:00:06'
+
+    def test_str_finished(self):
+        progress = Progress(40, 40, size=0, elapsed=2.0, finished=True)
+
+        assert str(progress) == '40 / 40 files, 0.0 MB, 20.0 files/s'
+
+
+class TestProgressCounter:
+    def test_local_counts(self):
+        statistics = SortStatistics('thread', 1, total=10)
+        counter = ProgressCounter(statistics, interval=60)
+
+        counter.add(1, 100)
+        counter.add(2, 200)
+
+        # Nothing is shared until the counts are merged
+        assert statistics.processed == 0
+        assert counter.count == 3
+
+        counter.merge()
+
+        assert statistics.processed == 3
+        assert statistics.bytes == 300
+        assert counter.count == 0
+        assert counter.size == 0
+
+    def test_periodic_merge(self):
+        statistics = SortStatistics('thread', 1, total=10)
+        counter = ProgressCounter(statistics, interval=0)
+
+        counter.add(1, 100)
+
+        assert statistics.processed == 1
+        assert statistics.bytes == 100
+
+    def test_merge_reports(self, mocker):
+        statistics = SortStatistics('thread', 1, total=10)
+        reporter = ProgressReporter(mocker.Mock(), statistics)
+        update = mocker.patch.object(reporter, 'update')
+
+        counter = ProgressCounter(statistics, reporter, interval=60)
+        counter.add()
+
+        update.assert_not_called()
+
+        counter.merge()
+
+        update.assert_called_once_with()
+
+    def test_many_workers(self):
+        statistics = SortStatistics('thread', 8, total=8000)
+
+        def work():
+            counter = ProgressCounter(statistics, interval=0.001)
+
+            for _ in range(1000):
+                counter.add(1, 2)
+
+            counter.merge()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert statistics.processed == 8000
+        assert statistics.bytes == 16000
+
+
+class TestProgressReporter:
+    def test_rate_limit(self):
+        reports = list()
+        statistics = SortStatistics('thread', 1, total=100)
+
+        reporter = ProgressReporter(
+            reports.append, statistics, discovery=FakeDiscovery(), rate=1
+        )
+
+        for _ in range(50):
+            statistics.add(1, 10)
+            reporter.update()
+
+        # Only the first update was reported within the interval
+        assert len(reports) == 1
+        assert reports[0].count == 1
+        assert reports[0].size == 10
+        assert reports[0].finished is False
+
+    def test_unlimited_rate(self):
+        reports = list()
+        statistics = SortStatistics('thread', 1, total=3)
+
+        reporter = ProgressReporter(reports.append, statistics, rate=0)
+
+        for _ in range(3):
+            statistics.add(1)
+            reporter.update()
+
+        assert [p.count for p in reports] == [1, 2, 3]
+
+    def test_final_report(self):
+        reports = list()
+        statistics = SortStatistics('thread', 1, total=3)
+
+        reporter = ProgressReporter(
+            reports.append, statistics, discovery=FakeDiscovery(), rate=1
+        )
+
+        for _ in range(3):
+            statistics.add(1, 10)
+            reporter.update()
+
+        assert [p.count for p in reports] == [1, 3]
+        assert reports[-1].finished is True
+        assert reports[-1].size == 30
+
+        # The final progress is only reported once
+        assert reporter.update() is False
+        assert len(reports) == 2
+
+    def test_final_report_with_failures(self):
+        reports = list()
+        statistics = SortStatistics('thread', 1, total=2)
+
+        reporter = ProgressReporter(
+            reports.append, statistics, discovery=FakeDiscovery(), rate=1
+        )
+
+        statistics.add(1)
+        reporter.update()
+
+        statistics.fail('file', 'OSError')
+        reporter.update()
+
+        # Files that failed still complete the sort
+        assert reports[-1].finished is True
+        assert reports[-1].count == 1
+
+    def test_queue_depth(self):
+        reports = list()
+        queue = Queue()
+        queue.put('file')
+
+        statistics = SortStatistics('thread', 1, total=2, queue=queue)
+        reporter = ProgressReporter(reports.append, statistics, rate=0)
+
+        statistics.add(1)
+        reporter.update()
+
+        assert reports[0].queued == 1
+
+    def test_discovery_running(self):
+        reports = list()
+        statistics = SortStatistics('thread', 1, total=1)
+        discovery = FakeDiscovery(finished=False)
+
+        reporter = ProgressReporter(
+            reports.append, statistics, discovery=discovery, rate=1
+        )
+
+        statistics.add(1)
+        reporter.update()
+
+        # More files may still be found
+        assert reports[0].finished is False
@@ -0,0 +1,162 @@
+import pickle
+import pytest
+import threading
+
+from dicomsort.pseudonyms import PseudonymStore, Pseudonymizer
+
+
+class TestPseudonymStore:
+    def test_get_missing(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+
+        assert store.get('PatientID', '123') is None
+
+    def test_add(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+
+        assert store.add('PatientID', '123', 'first') == 'first'
+        assert store.get('PatientID', '123') == 'first'
+
+        # The existing pseudonym is kept
+        assert store.add('PatientID', '123', 'second') == 'first'
+
+    def test_assign(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+
+        assert store.assign('PatientID', '123', 'SUBJ') == 'SUBJ000001'
+        assert store.assign('PatientID', '456', 'SUBJ') == 'SUBJ000002'
+        assert store.assign('PatientID', '123', 'SUBJ') == 'SUBJ000001'
+
+        # Every namespace is numbered separately
+        assert store.assign('OtherPatientIDs', '456', width=2) == '01'
+
+    def test_secret(self, tmpdir):
+        filename = str(tmpdir.join('pseudonyms.db'))
+
+        secret = PseudonymStore(filename).secret()
+
+        assert len(secret) == 32
+        assert PseudonymStore(filename).secret() == secret
+
+    def test_persistent(self, tmpdir):
+        filename = str(tmpdir.join('pseudonyms.db'))
+
+        store = PseudonymStore(filename)
+        store.assign('PatientID', '123')
+        store.close()
+
+        assert PseudonymStore(filename).get('PatientID', '123') == '000001'
+
+    def test_pickle(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+        store.add('PatientID', '123', 'first')
+
+        copy = pickle.loads(pickle.dumps(store))
+
+        assert copy.filename == store.filename
+        assert copy.get('PatientID', '123') == 'first'
+
+    def test_concurrent_assign(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+        results = list()
+
+        def work():
+            for index in range(20):
+                results.append(store.assign('PatientID', str(index)))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # Every thread received the same numbers for the same IDs
+        assert len(results) == 160
+        assert len(set(results)) == 20
+
+
+class TestPseudonymizer:
+    def test_invalid_strategy(self):
+        with pytest.raises(ValueError):
+            Pseudonymizer(strategy='invalid')
+
+    def test_hash(self):
+        pseudonymizer = Pseudonymizer(key='secret', prefix='ID')
+
+        pseudonym = pseudonymizer('123')
+
+        assert pseudonym.startswith('ID')
+        assert len(pseudonym) == 18
+        assert pseudonymizer('123') == pseudonym
+        assert pseudonymizer('456') != pseudonym
+
+    def test_hash_key(self):
+        first = Pseudonymizer(key='secret')
+        second = Pseudonymizer(key='secret')
+        other = Pseudonymizer(key='other')
+
+        assert first('123') == second('123')
+        assert first('123') != other('123')
+
+    def test_hash_store(self, tmpdir):
+        filename = str(tmpdir.join('pseudonyms.db'))
+
+        first = Pseudonymizer(store=PseudonymStore(filename))
+        second = Pseudonymizer(store=PseudonymStore(filename))
+
+        # Runs that share a store share the key
+        assert first('123') == second('123')
+        assert first.store.get('PatientID', '123') == first('123')
+
+    def test_counter(self):
+        pseudonymizer = Pseudonymizer(strategy='counter', prefix='SUBJ')
+
+        assert pseudonymizer('123') == 'SUBJ000001'
+        assert pseudonymizer('456') == 'SUBJ000002'
+        assert pseudonymizer('123') == 'SUBJ000001'
+
+    def test_counter_store(self, tmpdir):
+        filename = str(tmpdir.join('pseudonyms.db'))
+
+        first = Pseudonymizer(
+            strategy='counter', store=PseudonymStore(filename)
+        )
+        assert first('123') == '000001'
+
+        second = Pseudonymizer(
+            strategy='counter', store=PseudonymStore(filename)
+        )
+        assert second('456') == '000002'
+        assert second('123') == '000001'
+
+    def test_is_consistent(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+
+        assert Pseudonymizer().is_consistent() is True
+        assert Pseudonymizer(strategy='counter').is_consistent() is False
+        assert Pseudonymizer(
+            strategy='counter', store=store
+        ).is_consistent() is True
+
+    def test_empty_value(self):
+        assert Pseudonymizer(key='secret')('') == ''
+
+    def test_cached(self, mocker):
+        pseudonymizer = Pseudonymizer(key='secret')
+        digest = mocker.spy(pseudonymizer, 'digest')
+
+        pseudonymizer('123')
+        pseudonymizer('123')
+
+        digest.assert_called_once_with('123')
+
+    def test_pickle(self, tmpdir):
+        store = PseudonymStore(str(tmpdir.join('pseudonyms.db')))
+        pseudonymizer = Pseudonymizer(store=store)
+
+        copy = pickle.loads(pickle.dumps(pseudonymizer))
+
+        assert copy.key == pseudonymizer.key
+        assert copy('123') == pseudonymizer('123')
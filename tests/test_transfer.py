@@ -0,0 +1,193 @@
+import errno
+import os
+import pytest
+import stat
+
+from dicomsort import transfer
+
+
+@pytest.fixture(scope='function')
+def source(tmpdir):
+    fobj = tmpdir.join('source')
+    fobj.write_binary(b'DICOM' * 1000)
+    return str(fobj)
+
+
+class TestTemporaryName:
+    def test_same_directory(self, tmpdir):
+        destination = str(tmpdir.join('image'))
+
+        name = transfer.temporary_name(destination)
+
+        assert os.path.dirname(name) == str(tmpdir)
+        assert os.path.basename(name).startswith('.image.')
+        assert name != transfer.temporary_name(destination)
+
+
+def touch(path):
+    open(path, 'w').close()
+
+
+class TestReplace:
+    def test_replace(self, tmpdir):
+        destination = tmpdir.join('image')
+        destination.write('')
+
+        transfer.replace(str(destination), touch)
+
+        assert tmpdir.listdir() == [destination]
+
+    def test_replace_failure(self, tmpdir, mocker):
+        mocker.patch.object(os, 'replace', side_effect=OSError)
+
+        destination = str(tmpdir.join('image'))
+
+        with pytest.raises(OSError):
+            transfer.replace(destination, touch)
+
+        # The temporary file is removed
+        assert tmpdir.listdir() == []
+
+
+class TestStrategies:
+    def test_copy(self, source, tmpdir):
+        destination = str(tmpdir.join('destination'))
+
+        transfer.copy(source, destination)
+
+        assert open(destination, 'rb').read() == open(source, 'rb').read()
+
+    def test_hardlink(self, source, tmpdir):
+        destination = tmpdir.join('destination')
+        destination.write('')
+
+        transfer.hardlink(source, str(destination))
+
+        assert os.path.samefile(source, str(destination))
+
+    def test_symlink(self, source, tmpdir):
+        destination = tmpdir.join('destination')
+        destination.write('')
+
+        transfer.symlink(source, str(destination))
+
+        assert os.path.islink(str(destination))
+        assert os.readlink(str(destination)) == source
+
+    def test_kernel_copy(self, source, tmpdir):
+        destination = tmpdir.join('destination')
+        destination.write('placeholder' * 10000)
+
+        transfer.kernel_copy(source, str(destination))
+
+        assert destination.read_binary() == open(source, 'rb').read()
+        assert not os.path.samefile(source, str(destination))
+
+    def test_kernel_copy_sendfile(self, source, tmpdir, monkeypatch):
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+
+        destination = tmpdir.join('destination')
+
+        transfer.kernel_copy(source, str(destination))
+
+        assert destination.read_binary() == open(source, 'rb').read()
+
+    def test_reflink_unsupported_platform(self, source, tmpdir, mocker):
+        mocker.patch.object(transfer, 'fcntl', None)
+
+        with pytest.raises(OSError) as exc_info:
+            transfer.reflink(source, str(tmpdir.join('destination')))
+
+        assert exc_info.value.errno == errno.ENOTSUP
+
+
+class TestTransfer:
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            transfer.Transfer('invalid')
+
+    def test_copy_preserves_mode(self, source, tmpdir):
+        os.chmod(source, 0o640)
+        destination = str(tmpdir.join('destination'))
+
+        assert transfer.Transfer()(source, destination) == 'copy'
+        assert stat.S_IMODE(os.stat(destination).st_mode) == 0o640
+
+    def test_hardlink(self, source, tmpdir):
+        destination = str(tmpdir.join('destination'))
+
+        assert transfer.Transfer('hardlink')(source, destination) == 'hardlink'
+        assert os.path.samefile(source, destination)
+
+    def test_fallback(self, source, tmpdir, mocker):
+        error = OSError(errno.EXDEV, 'Cross-device link')
+        mocker.patch.dict(transfer.STRATEGIES, {
+            'hardlink': mocker.Mock(side_effect=error)
+        })
+
+        mover = transfer.Transfer('hardlink')
+
+        destination = str(tmpdir.join('destination'))
+
+        assert mover(source, destination) == 'copy'
+        assert mover.unsupported == {'hardlink'}
+
+        # The unsupported strategy isn't attempted again
+        mover(source, destination)
+        assert transfer.STRATEGIES['hardlink'].call_count == 1
+
+    def test_fallback_file_error(self, source, tmpdir, mocker):
+        error = OSError(errno.ENOENT, 'No such file')
+        mocker.patch.dict(transfer.STRATEGIES, {
+            'reflink': mocker.Mock(side_effect=error),
+            'kernel': mocker.Mock(side_effect=error),
+        })
+
+        mover = transfer.Transfer('auto')
+
+        destination = str(tmpdir.join('destination'))
+
+        assert mover(source, destination) == 'copy'
+
+        # Errors specific to a file don't disable the strategy
+        assert mover.unsupported == set()
+
+    def test_auto(self, source, tmpdir):
+        destination = str(tmpdir.join('destination'))
+
+        strategy = transfer.Transfer('auto')(source, destination)
+
+        assert strategy in ('reflink', 'kernel', 'copy')
+        assert open(destination, 'rb').read() == open(source, 'rb').read()
+
+    def test_move_rename(self, source, tmpdir):
+        inode = os.stat(source).st_ino
+        destination = tmpdir.join('destination')
+        destination.write('')
+
+        strategy = transfer.Transfer('auto').move(source, str(destination))
+
+        assert strategy == 'rename'
+        assert os.path.exists(source) is False
+        assert os.stat(str(destination)).st_ino == inode
+
+    def test_move_cross_device(self, source, tmpdir, mocker):
+        contents = open(source, 'rb').read()
+        error = OSError(errno.EXDEV, 'Cross-device link')
+        mocker.patch.object(os, 'replace', side_effect=error)
+
+        destination = str(tmpdir.join('destination'))
+
+        strategy = transfer.Transfer('symlink').move(source, destination)
+
+        # Links are never used because the source is removed
+        assert strategy == 'copy'
+        assert os.path.islink(destination) is False
+        assert open(destination, 'rb').read() == contents
+        assert os.path.exists(source) is False
+
+    def test_move_error(self, tmpdir):
+        missing = str(tmpdir.join('missing'))
+
+        with pytest.raises(OSError):
+            transfer.Transfer().move(missing, str(tmpdir.join('destination')))
@@ -1,4 +1,7 @@
 import os
+import pickle
+import pydicom
+import threading
 import unittest
 
 from dicomsort import utils
@@ -43,6 +46,104 @@ class TestRecurvsiveReplaceTokens(unittest.TestCase):
         assert output == 'prefix_%(Key6)s_suffix'
 
 
+class TestFormatTemplate:
+    def test_no_tokens(self):
+        template = utils.FormatTemplate('no_token_string')
+
+        assert template.fields == set()
+        assert template.render({}) == 'no_token_string'
+
+    def test_tokens(self):
+        template = utils.FormatTemplate('%(Key1)s_%(Key2)03d')
+
+        assert template.fields == {'Key1', 'Key2'}
+        assert template.render({'Key1': 'a', 'Key2': 1}) == 'a_001'
+
+    def test_nested_values(self):
+        template = utils.FormatTemplate('prefix_%(Key1)s_suffix')
+        values = {'Key1': '%(Key2)s', 'Key2': 'value'}
+
+        assert template.render(values) == 'prefix_value_suffix'
+
+    def test_max_nested_values(self):
+        template = utils.FormatTemplate('prefix_%(Key1)s_suffix')
+        values = {
+            'Key1': '%(Key2)s',
+            'Key2': '%(Key3)s',
+            'Key3': '%(Key4)s',
+            'Key4': '%(Key5)s',
+            'Key5': '%(Key6)s',
+            'Key6': 'blah',
+        }
+
+        # Matches recursive_replace_tokens
+        assert template.render(values) == 'prefix_%(Key6)s_suffix'
+
+    def test_expand_replacements(self):
+        replacements = {
+            'PatientID': '%(PatientName)s_%(StudyID)s',
+            'PatientName': 'ANONYMOUS',
+        }
+
+        template = utils.FormatTemplate('%(PatientID)s', replacements)
+
+        assert template.template == '%(PatientName)s_%(StudyID)s'
+        assert template.fields == {'PatientName', 'StudyID'}
+
+        values = {'PatientName': 'ANONYMOUS', 'StudyID': '1'}
+        assert template.render(values) == 'ANONYMOUS_1'
+
+    def test_expand_self_reference(self):
+        replacements = {'Key': 'a%(Key)s'}
+
+        template = utils.FormatTemplate('%(Key)s', replacements)
+
+        assert template.template == 'aaaa%(Key)s'
+
+    def test_compile_format(self):
+        template = utils.compile_format('%(Key)s')
+
+        assert isinstance(template, utils.FormatTemplate)
+        assert utils.compile_format(template) is template
+
+
+class TestFormatFields:
+    def test_no_tokens(self):
+        assert utils.format_fields('no_token_string') == set()
+
+    def test_tokens(self):
+        format_string = '%(Key1)s_%(Key2)04d_%(Key1)s'
+
+        assert utils.format_fields(format_string) == {'Key1', 'Key2'}
+
+
+class TestSniff:
+    def test_dicom(self, dicom_generator):
+        filename, _ = dicom_generator()
+
+        assert utils.sniff(filename) == 'dicom'
+
+    def test_not_dicom(self, tmpdir):
+        fid = tmpdir.join('image.jpg')
+        fid.write_binary(b'\xff\xd8\xff\xe0' + b'\0' * 256)
+
+        assert utils.sniff(str(fid)) is None
+        assert utils.sniff(str(fid), legacy=True) is None
+
+    def test_short_file(self, tmpdir):
+        fid = tmpdir.join('.DS_Store')
+        fid.write('short')
+
+        assert utils.sniff(str(fid)) is None
+
+    def test_legacy(self, dicom_generator, strip_preamble):
+        filename, _ = dicom_generator()
+        strip_preamble(filename)
+
+        assert utils.sniff(filename) is None
+        assert utils.sniff(filename, legacy=True) == 'legacy'
+
+
 class TestIsDicom:
     def test_dicomdir(self, dicom_generator):
         dicomdir, _ = dicom_generator('DICOMDIR')
@@ -60,6 +161,56 @@ class TestIsDicom:
 
         assert utils.isdicom(filename) is not False
 
+    def test_valid_dicom_full(self, dicom_generator):
+        filename, _ = dicom_generator(BitsAllocated=8, PixelData=b'\0' * 64)
+
+        assert 'PixelData' in utils.isdicom(filename)
+
+    def test_valid_dicom_header_only(self, dicom_generator):
+        filename, _ = dicom_generator(BitsAllocated=8, PixelData=b'\0' * 64)
+
+        dcm = utils.isdicom(filename, header_only=True)
+
+        assert dcm.PatientName == 'Jonathan^Suever'
+        assert 'PixelData' not in dcm
+
+    def test_valid_dicom_specific_tags(self, dicom_generator):
+        filename, _ = dicom_generator(PatientID='ID')
+
+        dcm = utils.isdicom(
+            filename, header_only=True, specific_tags=['PatientID']
+        )
+
+        assert dcm.PatientID == 'ID'
+        assert 'PatientName' not in dcm
+
+    def test_not_dicom_is_not_parsed(self, tmpdir, mocker):
+        func = mocker.patch.object(pydicom, 'read_file')
+
+        fid = tmpdir.join('document.pdf')
+        fid.write_binary(b'%PDF-1.4' + b'\0' * 256)
+
+        assert utils.isdicom(str(fid)) is False
+        assert utils.isdicom(str(fid), header_only=True) is False
+
+        func.assert_not_called()
+
+    def test_legacy_dicom(self, dicom_generator, strip_preamble):
+        filename, _ = dicom_generator(PatientID='ID')
+        strip_preamble(filename)
+
+        assert utils.isdicom(filename) is False
+
+        dcm = utils.isdicom(filename, header_only=True, legacy=True)
+
+        assert dcm.PatientID == 'ID'
+
+    def test_invalid_dicom_header_only(self, tmpdir):
+        fid = tmpdir.join('invalid')
+        fid.write('invalid')
+
+        assert utils.isdicom(str(fid), header_only=True) is False
+
 
 class TestCleanDirectoryName:
     def test_no_invalid_chars(self):
@@ -98,3 +249,193 @@ class TestMkdir:
         utils.mkdir(new_dir)
 
         assert os.path.exists(new_dir)
+
+
+class TestSQLiteFile:
+    class Table(utils.SQLiteFile):
+        schema = ('CREATE TABLE IF NOT EXISTS items (name TEXT)',)
+
+    def test_schema(self, tmpdir):
+        database = self.Table(str(tmpdir.join('items.db')))
+        database.connection().execute("INSERT INTO items VALUES ('a')")
+
+        rows = database.connection().execute('SELECT name FROM items')
+
+        assert rows.fetchall() == [('a',)]
+
+    def test_connection_per_thread(self, tmpdir):
+        database = self.Table(str(tmpdir.join('items.db')))
+        connections = list()
+
+        thread = threading.Thread(
+            target=lambda: connections.append(database.connection())
+        )
+        thread.start()
+        thread.join()
+
+        assert database.connection() is database.connection()
+        assert database.connection() is not connections[0]
+
+    def test_pickle(self, tmpdir):
+        database = self.Table(str(tmpdir.join('items.db')))
+        database.connection()
+
+        restored = pickle.loads(pickle.dumps(database))
+
+        assert restored.filename == database.filename
+        assert getattr(restored.local, 'connection', None) is None
+
+    def test_close(self, tmpdir):
+        database = self.Table(str(tmpdir.join('items.db')))
+        database.connection()
+        database.close()
+
+        assert database.local.connection is None
+
+
+class TestDirectoryCache:
+    def test_mkdir_once(self, tmpdir, mocker):
+        spy = mocker.spy(utils, 'mkdir')
+
+        cache = utils.DirectoryCache(str(tmpdir))
+        new_dir = str(tmpdir.join('new_dir').join('nested_dir'))
+
+        cache.mkdir(new_dir)
+        cache.mkdir(new_dir)
+
+        assert os.path.isdir(new_dir)
+        spy.assert_called_once_with(new_dir)
+
+    def test_seed_existing_directories(self, tmpdir, mocker):
+        existing = str(tmpdir.mkdir('existing'))
+
+        spy = mocker.spy(utils, 'mkdir')
+
+        cache = utils.DirectoryCache(str(tmpdir))
+        cache.mkdir(existing)
+
+        assert cache.seeded is True
+        assert str(tmpdir) in cache.directories
+        spy.assert_not_called()
+
+    def test_seed_missing_root(self, tmpdir):
+        root = str(tmpdir.join('output'))
+
+        cache = utils.DirectoryCache(root)
+        cache.seed()
+
+        assert cache.seeded is True
+        assert cache.directories == set()
+
+    def test_mkdir_failure_not_cached(self, tmpdir, mocker):
+        mocker.patch.object(utils, 'mkdir')
+
+        cache = utils.DirectoryCache()
+        cache.mkdir(str(tmpdir.join('new_dir')))
+
+        assert cache.directories == set()
+
+    def test_pickle(self, tmpdir):
+        cache = utils.DirectoryCache(str(tmpdir))
+        cache.seed()
+
+        copy = pickle.loads(pickle.dumps(cache))
+
+        assert copy.directories == cache.directories
+        assert copy.seeded is True
+
+
+class TestCopyName:
+    def test_copy_name(self):
+        assert utils.copy_name('image', 0) == 'image'
+        assert utils.copy_name('image', 1) == 'image.copy'
+        assert utils.copy_name('image', 2) == 'image.copy2'
+
+
+class TestDestinationRegistry:
+    def test_reserve(self, tmpdir):
+        destination = str(tmpdir.join('image'))
+
+        registry = utils.DestinationRegistry()
+
+        assert registry.reserve(destination) == destination
+        assert os.path.exists(destination)
+
+        # Unique destinations aren't remembered
+        assert registry.copies == dict()
+
+    def test_reserve_collisions(self, tmpdir):
+        destination = str(tmpdir.join('image'))
+
+        registry = utils.DestinationRegistry()
+
+        names = [registry.reserve(destination) for _ in range(3)]
+
+        assert names == [
+            destination,
+            destination + '.copy',
+            destination + '.copy2',
+        ]
+        assert registry.copies[destination] == 3
+
+    def test_release(self, tmpdir):
+        destination = str(tmpdir.join('file'))
+
+        registry = utils.DestinationRegistry()
+        registry.reserve(destination)
+        registry.release(destination)
+
+        assert not os.path.exists(destination)
+
+        # Releasing a destination that is already gone is not an error
+        registry.release(destination)
+
+    def test_reserve_existing_file(self, tmpdir):
+        fobj = tmpdir.join('image')
+        fobj.write('existing')
+
+        registry = utils.DestinationRegistry()
+
+        assert registry.reserve(str(fobj)) == str(fobj) + '.copy'
+        assert fobj.read() == 'existing'
+
+    def test_reserve_skips_probing(self, tmpdir, mocker):
+        destination = str(tmpdir.join('image'))
+
+        registry = utils.DestinationRegistry()
+        registry.reserve(destination)
+        registry.reserve(destination)
+
+        spy = mocker.spy(os, 'open')
+
+        assert registry.reserve(destination) == destination + '.copy2'
+        assert spy.call_count == 1
+
+    def test_reserve_concurrent(self, tmpdir):
+        destination = str(tmpdir.join('image'))
+
+        registry = utils.DestinationRegistry()
+        names = list()
+
+        def reserve():
+            for _ in range(10):
+                names.append(registry.reserve(destination))
+
+        threads = [threading.Thread(target=reserve) for _ in range(16)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert len(set(names)) == 160
+        assert len(tmpdir.listdir()) == 160
+
+    def test_pickle(self, tmpdir):
+        registry = utils.DestinationRegistry()
+        registry.copies['image'] = 2
+
+        copy = pickle.loads(pickle.dumps(registry))
+
+        assert copy.copies == {'image': 2}
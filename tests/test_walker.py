@@ -0,0 +1,98 @@
+import os
+
+from dicomsort import walker
+
+
+def make_tree(tmpdir):
+    tmpdir.join('a').write('')
+    nested = tmpdir.mkdir('nested')
+    nested.join('b').write('')
+    nested.mkdir('deeper').join('c').write('')
+    tmpdir.mkdir('empty')
+
+    return [
+        str(tmpdir.join('a')),
+        str(nested.join('b')),
+        str(nested.join('deeper').join('c')),
+    ]
+
+
+class TestScanDirectory:
+    def test_files_and_directories(self, tmpdir):
+        tmpdir.join('file').write('')
+        tmpdir.mkdir('directory')
+
+        files, subdirectories = walker.scan_directory(str(tmpdir))
+
+        assert files == [str(tmpdir.join('file'))]
+        assert subdirectories == [str(tmpdir.join('directory'))]
+
+    def test_directory_symlink(self, tmpdir):
+        target = tmpdir.mkdir('target')
+        os.symlink(str(target), str(tmpdir.join('link')))
+
+        files, subdirectories = walker.scan_directory(str(tmpdir))
+
+        assert files == []
+        assert subdirectories == [str(target)]
+
+    def test_missing_directory(self, tmpdir):
+        missing = str(tmpdir.join('missing'))
+
+        assert walker.scan_directory(missing) == ([], [])
+
+
+class TestWalkFiles:
+    def test_walk(self, tmpdir):
+        expected = make_tree(tmpdir)
+
+        assert sorted(walker.walk_files([str(tmpdir)])) == sorted(expected)
+
+    def test_walk_single_thread(self, tmpdir):
+        expected = make_tree(tmpdir)
+
+        files = walker.walk_files([str(tmpdir)], threads=1)
+
+        assert sorted(files) == sorted(expected)
+
+    def test_walk_multiple_paths(self, tmpdir):
+        first = tmpdir.mkdir('first')
+        second = tmpdir.mkdir('second')
+
+        first.join('a').write('')
+        second.join('b').write('')
+
+        files = walker.walk_files([str(first), str(second)])
+        expected = [str(first.join('a')), str(second.join('b'))]
+
+        assert sorted(files) == expected
+
+    def test_walk_matches_os_walk(self, tmpdir):
+        make_tree(tmpdir)
+
+        expected = [
+            os.path.join(root, filename)
+            for root, _, files in os.walk(str(tmpdir))
+            for filename in files
+        ]
+
+        files = walker.walk_files([str(tmpdir)])
+
+        assert sorted(files) == sorted(expected)
+
+    def test_walk_no_paths(self):
+        assert list(walker.walk_files([])) == []
+
+    def test_walk_empty_directory(self, tmpdir):
+        assert list(walker.walk_files([str(tmpdir)])) == []
+
+    def test_walk_stop_early(self, tmpdir):
+        make_tree(tmpdir)
+
+        tree = walker.TreeWalker([str(tmpdir)])
+        files = iter(tree)
+
+        next(files)
+        files.close()
+
+        assert tree.stopped.is_set()